@@ -0,0 +1,102 @@
+########################################################################################################################
+# --- Imports
+
+import itertools
+
+import pandas as pd
+
+from dbs_api.indexes import KEY_COLUMNS
+
+########################################################################################################################
+# --- Utils
+
+METRICS = ['UNRELATED_PARTY_REVENUES', 'RELATED_PARTY_REVENUES', 'TOTAL_REVENUES']
+
+# Continent of each country column of the sales mappings; CONTINENT_CODE refers to the affiliate country, as in the
+# irs and oecd tables from which the continents are taken
+CONTINENT_COLUMNS = {
+    'CONTINENT_CODE': 'AFFILIATE_COUNTRY_CODE',
+    'PARENT_CONTINENT_CODE': 'PARENT_COUNTRY_CODE',
+    'OTHER_CONTINENT_CODE': 'OTHER_COUNTRY_CODE',
+}
+
+GROUP_BY_COLUMNS = list(KEY_COLUMNS.values()) + list(CONTINENT_COLUMNS)
+
+# Rollups computed when the tables are loaded: every single dimension and the pairs of country columns
+COMMON_ROLLUPS = [()] + [(column, ) for column in GROUP_BY_COLUMNS] + list(
+    itertools.combinations(KEY_COLUMNS.values(), 2)
+)
+
+
+def build_continent_mapping(tables):
+    # Maps country codes to continent codes, based on the irs and oecd tables
+    continents = {}
+
+    for df in tables:
+
+        country_column = 'CODE' if 'CODE' in df.columns else 'AFFILIATE_COUNTRY_CODE'
+
+        continents.update(zip(df[country_column], df['CONTINENT_CODE']))
+
+    return continents
+
+
+########################################################################################################################
+# --- Aggregation of a sales mapping
+
+class SalesMappingAggregator:
+    """
+    Group-by sums of the revenue columns of a sales mapping. The dimensions are stored as categoricals, so that the
+    group-bys that are not precomputed run on integer codes.
+    """
+
+    def __init__(self, sales_mapping, continents):
+        dimensions = {}
+
+        for column in KEY_COLUMNS.values():
+            if column in sales_mapping.columns:
+                dimensions[column] = sales_mapping[column].astype('category')
+
+        for column, country_column in CONTINENT_COLUMNS.items():
+            if country_column in sales_mapping.columns:
+                dimensions[column] = sales_mapping[country_column].map(continents).astype('category')
+
+        self.frame = pd.DataFrame(dimensions).join(sales_mapping[METRICS])
+        self.dimensions = list(dimensions)
+
+        self.rollups = {}
+
+        for group_by in COMMON_ROLLUPS:
+            if all(column in self.dimensions for column in group_by):
+                self.rollups[frozenset(group_by)] = self.group(self.frame, list(group_by))
+
+    def group(self, frame, group_by):
+        if not group_by:
+            return frame[METRICS].sum().to_frame().T
+
+        result = frame.groupby(group_by, observed=True, sort=True)[METRICS].sum().reset_index()
+
+        return result.astype({column: str for column in group_by})
+
+    def check_group_by(self, group_by):
+        for column in group_by:
+            if column not in self.dimensions:
+                raise Exception(
+                    f"Cannot group by {column}. Available columns for this table are: {', '.join(self.dimensions)}."
+                )
+
+    def aggregate(self, group_by, metrics, positions=None):
+        # positions, if any, are the rows selected with the key index of the table
+        self.check_group_by(group_by)
+
+        if positions is None and frozenset(group_by) in self.rollups:
+            result = self.rollups[frozenset(group_by)]
+
+        else:
+            frame = self.frame if positions is None else self.frame.iloc[positions]
+            result = self.group(frame, group_by)
+
+        result = result[list(group_by) + list(metrics)]
+
+        # Precomputed rollups are sorted on their own column order, which may differ from the requested one
+        return result.sort_values(list(group_by), ignore_index=True) if group_by else result
@@ -2,17 +2,321 @@
 # --- Imports
 
 import os
-
-import pandas as pd
+import gc
+import time
+import hashlib
+import contextlib
 
 from flask import Flask
+from flask import Response
+from flask import g
+from flask import has_request_context
+from flask import jsonify
 from flask import request
+from flask import url_for
+from werkzeug.local import LocalProxy
+
+from dbs_api.aggregation import METRICS, GROUP_BY_COLUMNS
+from dbs_api.batch import LAYOUTS, parse_items, assemble_bundle, assemble_stacked
+from dbs_api.compression import ENCODINGS
+from dbs_api.diff import DIFF_STATUSES
+from dbs_api.indexes import KEY_COLUMNS
+from dbs_api.jobs import ComputationPool, normalize_parameters
+from dbs_api.metrics import metrics_registry, record_lookup, REQUEST_DURATION, PHASE_DURATION, RESPONSE_SIZE
+from dbs_api.metrics import SLOW_REQUEST_PROFILES
+from dbs_api.profiling import SamplingProfiler, PROFILE_THRESHOLD
+from dbs_api.registry import TableRegistry, INDEXED_TABLE_NAMES
+from dbs_api.reloading import RegistryReloader
+from dbs_api.serialization import OUTPUT_FORMATS, STREAMING_SERIALIZERS, ORIENTS, DEFAULT_PRECISION, MAX_PRECISION
+from dbs_api.serialization import to_json, encode_cursor, decode_cursor
+from dbs_api.tensor import DIMENSIONS
 
 ########################################################################################################################
 # --- Utils
 
-path_to_dir = os.path.dirname(os.path.abspath(__file__))
-path_to_outputs = os.path.join(path_to_dir, 'outputs')
+# With gunicorn --preload, the tables are loaded in the master process and the forked workers share its memory pages
+# as long as they do not write to them. Python objects are written to whenever they are referenced, hence string
+# columns are kept categorical (integer codes and a few distinct strings) unless DBS_API_SHARED_MEMORY=0
+SHARED_MEMORY = os.environ.get('DBS_API_SHARED_MEMORY', '1') != '0'
+
+# All the output tables are loaded and serialized once, when the app starts (or in the gunicorn master with --preload),
+# and again in the background of each worker when outputs.py publishes a new version of them
+registry_reloader = RegistryReloader(lambda: TableRegistry(categorical=SHARED_MEMORY).load())
+
+
+def get_registry():
+    # A request keeps the registry it started with, even if a new version is swapped in meanwhile
+    if not has_request_context():
+        return registry_reloader.registry
+
+    if 'registry' not in g:
+        g.registry = registry_reloader.get()
+
+    return g.registry
+
+
+registry = LocalProxy(get_registry)
+
+# Sales mappings computed with custom parameters, on a pool of processes started with the first request
+computation_pool = ComputationPool()
+
+# The objects created so far are moved out of the reach of the garbage collector, whose passes would otherwise write
+# to all of them in each worker
+if SHARED_MEMORY:
+    gc.freeze()
+
+# Opt-in profiler, which saves the stacks sampled during the requests slower than DBS_API_PROFILE_THRESHOLD seconds
+profiler = SamplingProfiler(float(PROFILE_THRESHOLD)) if PROFILE_THRESHOLD else None
+
+# The output files only change when outputs.py is rerun, so that clients and CDNs can keep the responses for a while
+# and then revalidate them with the ETag or Last-Modified headers
+CACHE_MAX_AGE = 3600
+
+
+@contextlib.contextmanager
+def timed(phase):
+    # Adds the duration of the block to the given phase of the current request
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        g.phases[phase] = g.phases.get(phase, 0) + time.perf_counter() - start
+
+
+def iter_measured(chunks, measures):
+    # Streamed responses are serialized while they are sent: the time spent producing each chunk is counted as
+    # serialization and the rest as sending
+    iterator = iter(chunks)
+
+    while True:
+        start = time.perf_counter()
+
+        try:
+            chunk = next(iterator)
+
+        except StopIteration:
+            return
+
+        finally:
+            measures['serialize'] += time.perf_counter() - start
+
+        measures['size'] += len(chunk)
+
+        yield chunk
+
+
+def get_key_filters(available_columns, scope=None):
+    # Each of the parent, affiliate and other arguments can be repeated or take a comma-separated list of codes; the
+    # parent of US multinationals is implicitly the United States
+    filters = {}
+
+    if scope == 'US':
+        available_columns = list(available_columns) + [KEY_COLUMNS['parent']]
+
+    for argument, column in KEY_COLUMNS.items():
+        codes = [code.strip().upper() for value in request.args.getlist(argument) for code in value.split(',')]
+        codes = [code for code in codes if code]
+
+        if not codes:
+            continue
+
+        if column not in available_columns:
+            raise Exception(f"The '{argument}' argument is not available for this table.")
+
+        filters[column] = codes
+
+    return filters
+
+
+def get_list_argument(argument, available_values):
+    values = [value.strip() for item in request.args.getlist(argument) for value in item.split(',') if value.strip()]
+
+    for value in values:
+        if value not in available_values:
+            raise Exception(
+                f"The '{argument}' argument can only take the following values: {', '.join(available_values)}."
+            )
+
+    return list(dict.fromkeys(values))
+
+
+def get_page_bounds(n_rows):
+    limit = request.args.get('limit', default=None, type=int)
+    cursor = request.args.get('cursor', default=None, type=str)
+
+    if limit is not None and limit <= 0:
+        raise Exception("The 'limit' argument must be a positive integer.")
+
+    start = decode_cursor(cursor) if cursor else 0
+    stop = n_rows if limit is None else min(start + limit, n_rows)
+
+    return start, max(start, stop)
+
+
+def get_serialization_arguments():
+    output_format = request.args.get('format', default='json', type=str)
+
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f"The 'format' argument can only take the following values: {', '.join(OUTPUT_FORMATS)}.")
+
+    orient = request.args.get('orient', default='columns', type=str)
+
+    if orient not in ORIENTS:
+        raise Exception(f"The 'orient' argument can only take the following values: {', '.join(ORIENTS)}.")
+
+    precision = request.args.get('precision', default=None, type=int)
+
+    if precision is not None and not 0 <= precision <= MAX_PRECISION:
+        raise Exception(f"The 'precision' argument must be an integer between 0 and {MAX_PRECISION}.")
+
+    return output_format, orient, precision
+
+
+def get_ranking_arguments():
+    sort_by = request.args.get('sort_by', default=None, type=str)
+    order = request.args.get('order', default='desc', type=str)
+    top = request.args.get('top', default=None, type=int)
+
+    if top is not None and top <= 0:
+        raise Exception("The 'top' argument must be a positive integer.")
+
+    if top is not None and sort_by is None:
+        raise Exception("The 'top' argument requires a column to sort by, given with the 'sort_by' argument.")
+
+    return sort_by, order, top
+
+
+def get_etag(version, encoding):
+    # The tag is derived from the content hash of the output file and identifies the representation, which also
+    # depends on the query arguments and on the negotiated content coding
+    arguments = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    variant = hashlib.sha256(f'{request.path}?{arguments};{encoding}'.encode('utf-8')).hexdigest()
+
+    return f'{version["hash"][:32]}-{variant[:16]}'
+
+
+def is_not_modified(etag, last_modified):
+    # As per RFC 7232, If-Modified-Since is ignored when the request carries an If-None-Match header, whose tags are
+    # compared weakly, so that the tags weakened by proxies and CDNs still match
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+
+    elif request.if_modified_since is not None:
+        not_modified = last_modified <= request.if_modified_since
+
+    else:
+        return False
+
+    record_lookup('http_validators', not_modified)
+
+    return not_modified
+
+
+def combine_versions(versions):
+    # Validators of a response built from several output files
+    return {
+        'hash': hashlib.sha256(''.join(version['hash'] for version in versions).encode('utf-8')).hexdigest(),
+        'last_modified': max(version['last_modified'] for version in versions),
+    }
+
+
+def add_caching_headers(response, etag, version):
+    response.set_etag(etag)
+    response.last_modified = version['last_modified']
+
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def send_payload(table, year, scope, orient, precision, encoding):
+    compressed_payload = None
+
+    if encoding is not None:
+        with timed('compress'):
+            compressed_payload = registry.get_compressed_payload(table, year, scope, orient, precision, encoding)
+
+    if compressed_payload is None:
+        with timed('serialize'):
+            payload = registry.get_payload(table, year, scope, orient, precision)
+
+        response = Response(payload, mimetype='application/json')
+
+    else:
+        response = Response(compressed_payload, mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def send_table(table, year, scope):
+    output_format, orient, precision = get_serialization_arguments()
+    json_precision = DEFAULT_PRECISION if precision is None else precision
+
+    # Conditional requests are answered from the version of the output file, before the table is even looked at
+    with timed('load'):
+        version = registry.get_version(table, year, scope)
+
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    etag = get_etag(version, encoding)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    with timed('load'):
+        df = registry.get_table(table, year, scope)
+
+    if table in INDEXED_TABLE_NAMES:
+        filters = get_key_filters(df.columns, scope)
+
+    else:
+        # The other tables reject the country filters, rather than returning all their rows as if they were filtered
+        filters = get_key_filters([])
+
+    sort_by, order, top = get_ranking_arguments()
+
+    paged = 'limit' in request.args or 'cursor' in request.args
+
+    # Fast path: the full table in JSON is sent from the payloads pre-serialized (and compressed) by the registry
+    if not filters and sort_by is None and not paged and output_format == 'json':
+        return add_caching_headers(send_payload(table, year, scope, orient, json_precision, encoding), etag, version)
+
+    with timed('filter'):
+        if sort_by is None:
+            positions = registry.select_positions(table, year, scope, filters)
+
+        else:
+            positions = registry.rank_positions(table, year, scope, sort_by, order, top, filters)
+
+        start, stop = get_page_bounds(len(positions))
+        page = positions[start:stop]
+
+    if output_format == 'json':
+        # Pages and filtered selections are serialized on the fly
+        with timed('serialize'):
+            payload = to_json(df.iloc[page], orient, json_precision)
+
+        response = Response(payload, mimetype=OUTPUT_FORMATS['json'])
+
+    elif output_format == 'ndjson':
+        response = Response(
+            STREAMING_SERIALIZERS['ndjson'](df, page, json_precision), mimetype=OUTPUT_FORMATS['ndjson']
+        )
+
+    else:
+        response = Response(STREAMING_SERIALIZERS['csv'](df, page, precision), mimetype=OUTPUT_FORMATS['csv'])
+
+    response.headers['X-Total-Count'] = str(len(positions))
+
+    if stop < len(positions):
+        response.headers['X-Next-Cursor'] = encode_cursor(stop)
+
+    return add_caching_headers(response, etag, version)
 
 
 ########################################################################################################################
@@ -21,6 +325,63 @@ path_to_outputs = os.path.join(path_to_dir, 'outputs')
 app = Flask(__name__)
 
 
+@app.before_request
+def start_request_metrics():
+    g.start = time.perf_counter()
+    g.phases = {}
+
+    if profiler is not None:
+        profiler.begin()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # The phases timed in the routes are completed with the rest of the handling ('other') and, once the response is
+    # closed by the server, with its sending
+    start, phases = g.start, g.phases
+    phases['other'] = max(time.perf_counter() - start - sum(phases.values()), 0)
+
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = response.status_code
+
+    measures = {'serialize': 0, 'size': 0}
+
+    if response.is_streamed:
+        response.response = iter_measured(response.response, measures)
+
+    else:
+        measures['size'] = response.content_length or 0
+
+    def on_close():
+        duration = time.perf_counter() - start
+
+        phases['serialize'] = phases.get('serialize', 0) + measures['serialize']
+        phases['send'] = max(duration - sum(phases.values()), 0)
+
+        for phase, phase_duration in phases.items():
+            PHASE_DURATION.observe(phase_duration, route, phase)
+
+        REQUEST_DURATION.observe(duration, route, status)
+        RESPONSE_SIZE.observe(measures['size'], route)
+
+        if profiler is not None and profiler.end(duration, route.strip('/').replace('/', '_') or 'index'):
+            SLOW_REQUEST_PROFILES.inc(route)
+
+        metrics_registry.save_snapshot()
+
+    response.call_on_close(on_close)
+
+    return response
+
+
+@app.route(
+    '/metrics',
+    methods=['GET']
+)
+def get_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route(
     '/',
     methods=['GET']
@@ -43,14 +404,7 @@ def get_adjusted_US_sales_mapping():
     if year not in [2016, 2017, 2018, 2019]:
         raise Exception('The adjusted sales mapping for US multinationals is only available from 2016 to 2019.')
 
-    sales_mapping = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'sales_mapping_US_{year}.csv'
-        )
-    )
-
-    return sales_mapping.to_json()
+    return send_table('sales_mapping', year, 'US')
 
 
 @app.route(
@@ -74,14 +428,7 @@ def get_adjusted_global_sales_mapping():
             + "bilateral breakdown via the OECD. If you choose 'unrestricted', all parent countries are included."
         )
 
-    sales_mapping = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'sales_mapping_{"global_" + scope_suffix}_{year}.csv'
-        )
-    )
-
-    return sales_mapping.to_json()
+    return send_table('sales_mapping', year, 'global_' + scope_suffix)
 
 
 ########################################################################################################################
@@ -98,14 +445,7 @@ def get_US_intermediary_dataframe_1():
     if year not in [2016, 2017, 2018, 2019]:
         raise Exception('The first intermediary DataFrame for US multinationals is only available from 2016 to 2019.')
 
-    intermediary_dataframe_1 = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'intermediary_dataframe_1_US_{year}.csv'
-        )
-    )
-
-    return intermediary_dataframe_1.to_json()
+    return send_table('intermediary_dataframe_1', year, 'US')
 
 
 @app.route(
@@ -119,14 +459,7 @@ def get_US_intermediary_dataframe_2():
     if year not in [2016, 2017, 2018, 2019]:
         raise Exception('The second intermediary DataFrame for US multinationals is only available from 2016 to 2019.')
 
-    intermediary_dataframe_2 = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'intermediary_dataframe_2_US_{year}.csv'
-        )
-    )
-
-    return intermediary_dataframe_2.to_json()
+    return send_table('intermediary_dataframe_2', year, 'US')
 
 
 @app.route(
@@ -140,14 +473,7 @@ def get_global_intermediary_dataframe_1():
     if year not in [2016, 2017]:
         raise Exception("The first intermediary DataFrame based on OECD data is only available for 2016 and 2017.")
 
-    intermediary_dataframe_1 = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'intermediary_dataframe_1_global_restricted_{year}.csv'
-        )
-    )
-
-    return intermediary_dataframe_1.to_json()
+    return send_table('intermediary_dataframe_1', year, 'global_restricted')
 
 
 @app.route(
@@ -161,11 +487,328 @@ def get_global_intermediary_dataframe_2():
     if year not in [2016, 2017]:
         raise Exception("The second intermediary DataFrame based on OECD data is only available for 2016 and 2017.")
 
-    intermediary_dataframe_2 = pd.read_csv(
-        os.path.join(
-            path_to_outputs,
-            f'intermediary_dataframe_2_global_restricted_{year}.csv'
+    return send_table('intermediary_dataframe_2', year, 'global_restricted')
+
+
+########################################################################################################################
+# --- Batch route returning several tables at once
+
+@app.route(
+    '/batch',
+    methods=['GET']
+)
+def get_batch():
+
+    items = parse_items(request.args.getlist('items'))
+
+    for item in items:
+        registry.check_key(*item)
+
+    layout = request.args.get('layout', default='bundle', type=str)
+
+    if layout not in LAYOUTS:
+        raise Exception(f"The 'layout' argument can only take the following values: {', '.join(LAYOUTS)}.")
+
+    _, orient, precision = get_serialization_arguments()
+    precision = DEFAULT_PRECISION if precision is None else precision
+
+    # The validators of the batch combine those of the output files it is made of
+    version = combine_versions([registry.get_version(*item) for item in items])
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    with timed('serialize'):
+        if layout == 'bundle':
+            payload = assemble_bundle(registry, items, orient, precision)
+
+        else:
+            payload = assemble_stacked(registry, items, precision)
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+########################################################################################################################
+# --- Aggregates of the sales mappings
+
+@app.route(
+    '/aggregate',
+    methods=['GET']
+)
+def get_aggregate():
+
+    scope = request.args.get('scope', default='US', type=str)
+    year = request.args.get('year', default=2018 if scope == 'US' else 2017, type=int)
+
+    registry.check_key('sales_mapping', year, scope)
+
+    group_by = get_list_argument('group_by', GROUP_BY_COLUMNS)
+    metrics = get_list_argument('metric', METRICS) or METRICS
+
+    _, orient, precision = get_serialization_arguments()
+
+    version = registry.get_version('sales_mapping', year, scope)
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    filters = get_key_filters(registry.get_table('sales_mapping', year, scope).columns, scope)
+    with timed('compute'):
+        result = registry.aggregate('sales_mapping', year, scope, group_by, metrics, filters)
+
+    with timed('serialize'):
+        payload = to_json(result, orient, DEFAULT_PRECISION if precision is None else precision)
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+########################################################################################################################
+# --- Slices and bilateral matrices of the sales mappings, based on their sparse representation
+
+def get_dimension_filters():
+    # The parent argument is accepted for US multinationals too, whose parent country is always the United States
+    dimensions = {column: dimension for dimension, column in KEY_COLUMNS.items()}
+
+    return {dimensions[column]: codes for column, codes in get_key_filters(KEY_COLUMNS.values()).items()}
+
+
+def get_tensor_arguments():
+    scope = request.args.get('scope', default='US', type=str)
+    year = request.args.get('year', default=2018 if scope == 'US' else 2017, type=int)
+
+    tensor = registry.get_tensor('sales_mapping', year, scope)
+
+    return tensor, year, scope, get_dimension_filters()
+
+
+@app.route(
+    '/slice',
+    methods=['GET']
+)
+def get_slice():
+
+    tensor, year, scope, filters = get_tensor_arguments()
+    _, orient, precision = get_serialization_arguments()
+
+    version = registry.get_version('sales_mapping', year, scope)
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    with timed('filter'):
+        result = tensor.slice(filters)
+
+    with timed('serialize'):
+        payload = to_json(result, orient, DEFAULT_PRECISION if precision is None else precision)
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+@app.route(
+    '/matrix',
+    methods=['GET']
+)
+def get_matrix():
+
+    tensor, year, scope, filters = get_tensor_arguments()
+    _, _, precision = get_serialization_arguments()
+
+    rows = request.args.get('rows', default='parent', type=str)
+    columns = request.args.get('columns', default='other', type=str)
+    metric = request.args.get('metric', default='TOTAL_REVENUES', type=str)
+
+    if rows not in DIMENSIONS or columns not in DIMENSIONS or rows == columns:
+        raise Exception(
+            f"The 'rows' and 'columns' arguments must be two different values among: {', '.join(DIMENSIONS)}."
         )
+
+    if metric not in METRICS:
+        raise Exception(f"The 'metric' argument can only take the following values: {', '.join(METRICS)}.")
+
+    version = registry.get_version('sales_mapping', year, scope)
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    with timed('compute'):
+        matrix = tensor.matrix(rows, columns, metric, filters)
+
+    with timed('serialize'):
+        payload = matrix.to_json(
+            orient='split', double_precision=DEFAULT_PRECISION if precision is None else precision
+        )
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+########################################################################################################################
+# --- Time series of the sales mappings
+
+@app.route(
+    '/timeseries',
+    methods=['GET']
+)
+def get_timeseries():
+
+    scope = request.args.get('scope', default='US', type=str)
+    panel = registry.get_panel(scope)
+
+    filters = get_dimension_filters()
+
+    metrics = get_list_argument('metric', METRICS) or METRICS
+
+    _, orient, precision = get_serialization_arguments()
+
+    version = combine_versions([registry.get_version('sales_mapping', year, scope) for year in panel.years])
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    with timed('filter'):
+        result = panel.lookup(filters, metrics)
+
+    with timed('serialize'):
+        payload = to_json(result, orient, DEFAULT_PRECISION if precision is None else precision)
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+########################################################################################################################
+# --- Differences between two years or scopes of a table
+
+@app.route(
+    '/diff',
+    methods=['GET']
+)
+def get_diff():
+
+    if 'left' not in request.args or 'right' not in request.args:
+        raise Exception("The 'left' and 'right' arguments are required, for instance left=oecd:2016:global_restricted.")
+
+    left, right = [parse_items(request.args.getlist(argument)) for argument in ['left', 'right']]
+
+    if len(left) != 1 or len(right) != 1:
+        raise Exception("The 'left' and 'right' arguments must each refer to a single table:year:scope combination.")
+
+    left, right = left[0], right[0]
+
+    if left[0] != right[0]:
+        raise Exception("The 'left' and 'right' arguments must refer to the same table.")
+
+    statuses = get_list_argument('status', DIFF_STATUSES)
+
+    _, orient, precision = get_serialization_arguments()
+    precision = DEFAULT_PRECISION if precision is None else precision
+
+    version = combine_versions([registry.get_version(*left), registry.get_version(*right)])
+    etag = get_etag(version, None)
+
+    if is_not_modified(etag, version['last_modified']):
+        return add_caching_headers(Response(status=304), etag, version)
+
+    if statuses:
+        with timed('compute'):
+            diff = registry.diff(left, right)
+            diff = diff[diff['STATUS'].isin(statuses)].reset_index(drop=True)
+
+        with timed('serialize'):
+            payload = to_json(diff, orient, precision)
+
+    else:
+        # Computed and serialized at once, unless the payload is cached
+        with timed('serialize'):
+            payload = registry.get_diff_payload(left, right, orient, precision)
+
+    return add_caching_headers(Response(payload, mimetype='application/json'), etag, version)
+
+
+########################################################################################################################
+# --- Diagnostics
+
+@app.route(
+    '/diagnostics',
+    methods=['GET']
+)
+def get_diagnostics():
+
+    tables = registry.get_memory_usage()
+
+    return jsonify(
+        {
+            'data_version': registry.data_version,
+            'load_time': registry.load_time,
+            'countries': len(registry.countries),
+            'memory': sum(table['memory'] for table in tables),
+            'payloads': sum(table['payloads'] for table in tables),
+            'compressed_payloads': sum(table['compressed_payloads'] for table in tables),
+            'tables': tables,
+        }
     )
 
-    return intermediary_dataframe_2.to_json()
+
+########################################################################################################################
+# --- Sales mappings computed with custom parameters
+
+def send_job_status(job_id):
+    status = computation_pool.get_status(job_id)
+
+    if status == 'unknown':
+        return jsonify({'job_id': job_id, 'status': status}), 404
+
+    body = {
+        'job_id': job_id,
+        'status': status,
+        'url': url_for('get_custom_sales_mapping', job_id=job_id),
+    }
+
+    if status == 'failed':
+        body['error'] = computation_pool.get_error(job_id)
+        return jsonify(body), 500
+
+    if status == 'pending':
+        response = jsonify(body)
+        response.status_code = 202
+        response.headers['Location'] = body['url']
+        response.headers['Retry-After'] = '5'
+
+        return response
+
+    return jsonify(body), 200
+
+
+@app.route(
+    '/custom_sales_mapping',
+    methods=['GET']
+)
+def submit_custom_sales_mapping():
+
+    scope = request.args.get('scope', default='US', type=str)
+    year = request.args.get('year', default=2018 if scope == 'US' else 2017, type=int)
+
+    _, parameters = normalize_parameters(scope, year, request.args)
+
+    job_id = computation_pool.submit(scope, parameters)
+
+    return send_job_status(job_id)
+
+
+@app.route(
+    '/custom_sales_mapping/<job_id>',
+    methods=['GET']
+)
+def get_custom_sales_mapping(job_id):
+
+    if computation_pool.get_status(job_id) != 'done':
+        return send_job_status(job_id)
+
+    payload = computation_pool.get_result(job_id)
+
+    if payload is None:
+        return send_job_status(job_id)
+
+    return Response(payload, mimetype='application/json')
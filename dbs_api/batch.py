@@ -0,0 +1,102 @@
+########################################################################################################################
+# --- Imports
+
+import json
+
+from dbs_api.registry import TABLE_NAMES
+
+########################################################################################################################
+# --- Utils
+
+LAYOUTS = ['bundle', 'stacked']
+
+
+def parse_items(values):
+    # Items are given as table:year:scope, in repeated arguments or as comma-separated lists
+    items = []
+
+    for value in values:
+        for item in value.split(','):
+
+            if not item.strip():
+                continue
+
+            try:
+                table, year, scope = item.strip().split(':')
+                year = int(year)
+
+            except ValueError:
+                raise Exception(f'The item {item} is not valid: items must be given as table:year:scope.')
+
+            if table not in TABLE_NAMES:
+                raise Exception(f"The table {table} does not exist. Tables are: {', '.join(TABLE_NAMES)}.")
+
+            if (table, year, scope) not in items:
+                items.append((table, year, scope))
+
+    if not items:
+        raise Exception("The 'items' argument is required, for instance items=sales_mapping:2016:US.")
+
+    return items
+
+
+########################################################################################################################
+# --- Batch payloads, assembled from the payloads already serialized by the registry
+
+def assemble_bundle(registry, items, orient, precision):
+    # One JSON object per item, whose data is the payload that the table routes would send back
+    parts = [b'{"items":[']
+
+    for i, (table, year, scope) in enumerate(items):
+        header = {'table': table, 'year': year, 'scope': scope}
+
+        parts.append((',' if i else '').encode('utf-8'))
+        parts.append(json.dumps(header)[:-1].encode('utf-8') + b',"data":')
+        parts.append(registry.get_payload(table, year, scope, orient, precision))
+        parts.append(b'}')
+
+    parts.append(b']}')
+
+    return b''.join(parts)
+
+
+def assemble_stacked(registry, items, precision):
+    # A single 'arrays' payload in which the tables are stacked, with YEAR and SCOPE columns identifying their rows;
+    # the columns that a table lacks are filled with nulls
+    if len({table for table, _, _ in items}) > 1:
+        raise Exception("The 'stacked' layout requires all the items to refer to the same table.")
+
+    tables = [registry.get_table(*item) for item in items]
+
+    columns = []
+
+    for df in tables:
+        columns += [column for column in df.columns if column not in columns]
+
+    def join_values(chunks):
+        return b'[' + b','.join(chunk for chunk in chunks if chunk) + b']'
+
+    parts = [
+        b'{"YEAR":',
+        join_values((f'{year},' * len(df))[:-1].encode('utf-8') for (_, year, _), df in zip(items, tables)),
+        b',"SCOPE":',
+        join_values((f'"{scope}",' * len(df))[:-1].encode('utf-8') for (_, _, scope), df in zip(items, tables)),
+    ]
+
+    for column in columns:
+        chunks = []
+
+        for item, df in zip(items, tables):
+
+            if column in df.columns:
+                # The precomputed JSON array, without its brackets
+                chunks.append(registry.get_column_array(*item, column, precision)[1:-1])
+
+            else:
+                chunks.append(('null,' * len(df))[:-1].encode('utf-8'))
+
+        parts += [b',', json.dumps(column).encode('utf-8'), b':', join_values(chunks)]
+
+    parts.append(b'}')
+
+    return b''.join(parts)
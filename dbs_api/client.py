@@ -0,0 +1,300 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import pandas as pd
+import requests
+
+from dbs_api.columnar import read_columnar, write_columnar
+
+########################################################################################################################
+# --- Utils
+
+DEFAULT_URL = os.environ.get('DBS_API_URL', 'http://127.0.0.1:8000')
+DEFAULT_CACHE_DIR = os.environ.get('DBS_API_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'dbs_api'))
+
+# Number of tables fetched at once, which is also the number of connections kept open to the API
+MAX_WORKERS = 4
+
+# Size of the disk cache, in bytes, above which the least recently used responses are deleted
+MAX_CACHE_SIZE = int(os.environ.get('DBS_API_CACHE_SIZE', 2 ** 30))
+
+# Tables served by a route of their own, for each scope; the others are fetched through /batch
+TABLE_ROUTES = {
+    ('sales_mapping', 'US'): '/US_sales_mapping',
+    ('sales_mapping', 'global_restricted'): '/global_sales_mapping',
+    ('sales_mapping', 'global_unrestricted'): '/global_sales_mapping',
+    ('intermediary_dataframe_1', 'US'): '/US_intermediary_dataframe_1',
+    ('intermediary_dataframe_2', 'US'): '/US_intermediary_dataframe_2',
+    ('intermediary_dataframe_1', 'global_restricted'): '/global_intermediary_dataframe_1',
+    ('intermediary_dataframe_2', 'global_restricted'): '/global_intermediary_dataframe_2',
+}
+
+
+def normalize_params(params):
+    # Lists of country codes are sent comma-separated, and the arguments are sorted so that the same request always
+    # has the same cache key
+    normalized = {}
+
+    for key, value in params.items():
+        if value is None:
+            continue
+
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(item) for item in value)
+
+        normalized[key] = str(value)
+
+    return sorted(normalized.items())
+
+
+def get_table_request(table, year, scope):
+    # Route and arguments returning a single table
+    route = TABLE_ROUTES.get((table, scope))
+
+    if route is None:
+        return '/batch', {'items': f'{table}:{year}:{scope}'}
+
+    params = {'year': year}
+
+    if route == '/global_sales_mapping':
+        params['scope'] = scope.split('_')[1]
+
+    return route, params
+
+
+def get_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(dir_path, file_name))
+        for dir_path, _, file_names in os.walk(path) for file_name in file_names
+    )
+
+
+def decode_arrays(content):
+    return pd.DataFrame(json.loads(content))
+
+
+def decode_batch(content):
+    return pd.DataFrame(json.loads(content)['items'][0]['data'])
+
+
+########################################################################################################################
+# --- Client
+
+class Client:
+    """
+    Client of the API, which keeps its connections open between requests and caches the responses on disk, keyed by
+    route and arguments. A cached response is revalidated with its ETag, so that an unchanged table costs a 304, and
+    neither a download nor a parsing. Tables are requested in the 'arrays' layout, which is decoded into a DataFrame
+    without any reshaping, and cached in the columnar format of the outputs. The cache is bounded by max_cache_size
+    bytes, beyond which the least recently used responses are deleted.
+    """
+
+    def __init__(
+        self, url=DEFAULT_URL, cache_dir=DEFAULT_CACHE_DIR, max_workers=MAX_WORKERS, timeout=60,
+        max_cache_size=MAX_CACHE_SIZE,
+    ):
+        self.url = url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_cache_size = max_cache_size
+
+        # Sessions are not thread-safe: each thread has its own, all of them sharing the pool of connections
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.sessions = threading.local()
+
+        # Outcome of the requests sent by this client: 'downloaded', 'revalidated' (304) or 'uncached'
+        self.stats = {'downloaded': 0, 'revalidated': 0, 'uncached': 0}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.adapter.close()
+
+    def get_session(self):
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = requests.Session()
+            self.sessions.session.mount('http://', self.adapter)
+            self.sessions.session.mount('https://', self.adapter)
+
+        return self.sessions.session
+
+    def get_cache_path(self, kind, route, params):
+        key = hashlib.sha256(f'{kind}:{route}?{urlencode(params)}'.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir, key[:32])
+
+    def read_cache(self, kind, cache_path, decode):
+        # Returns the ETag and the value of a cached response, or (None, None) if there is none; the cache only holds
+        # data files, tables in the columnar format of the outputs and other responses as they were received
+        try:
+            with open(cache_path + '.etag') as file:
+                etag = file.read()
+
+            # The modification time of the ETag is the last use of the response, for the eviction
+            os.utime(cache_path + '.etag')
+
+            if kind == 'frame':
+                return etag, read_columnar(cache_path + '.columnar', mmap=False)
+
+            with open(cache_path + '.body', 'rb') as file:
+                return etag, decode(file.read())
+
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def write_cache(self, kind, cache_path, etag, content, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # The ETag is removed while the value is replaced, so that a value is never revalidated with the ETag of
+        # another one
+        if os.path.exists(cache_path + '.etag'):
+            os.remove(cache_path + '.etag')
+
+        temporary_suffix = f'.{os.getpid()}-{threading.get_ident()}.tmp'
+
+        if kind == 'frame':
+            write_columnar(value, cache_path + '.columnar' + temporary_suffix)
+
+            if os.path.exists(cache_path + '.columnar'):
+                shutil.rmtree(cache_path + '.columnar')
+
+            os.rename(cache_path + '.columnar' + temporary_suffix, cache_path + '.columnar')
+
+        else:
+            self.write_file(cache_path + '.body', temporary_suffix, content)
+
+        self.write_file(cache_path + '.etag', temporary_suffix, etag.encode('utf-8'))
+
+        self.prune_cache()
+
+    @staticmethod
+    def remove_cache_entry(cache_path):
+        # The ETag is removed first, so that the entry is never read while its value is being removed
+        for extension in ['.etag', '.body']:
+            if os.path.exists(cache_path + extension):
+                os.remove(cache_path + extension)
+
+        shutil.rmtree(cache_path + '.columnar', ignore_errors=True)
+
+    def prune_cache(self):
+        # Deletes the least recently used responses until the cache is within max_cache_size; the entries being
+        # written, which have no ETag yet, are left alone
+        sizes, last_uses = {}, {}
+
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.tmp'):
+                continue
+
+            key = file_name.split('.')[0]
+            file_path = os.path.join(self.cache_dir, file_name)
+
+            try:
+                sizes[key] = sizes.get(key, 0) + get_size(file_path)
+
+                if file_name.endswith('.etag'):
+                    last_uses[key] = os.path.getmtime(file_path)
+
+            except OSError:
+                continue
+
+        cache_size = sum(sizes.values())
+
+        for key in sorted(last_uses, key=last_uses.get):
+            if cache_size <= self.max_cache_size:
+                break
+
+            try:
+                self.remove_cache_entry(os.path.join(self.cache_dir, key))
+
+            except OSError:
+                continue
+
+            cache_size -= sizes[key]
+
+    def clear_cache(self):
+        if self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @staticmethod
+    def write_file(file_path, temporary_suffix, content):
+        with open(file_path + temporary_suffix, 'wb') as file:
+            file.write(content)
+
+        os.replace(file_path + temporary_suffix, file_path)
+
+    def record(self, outcome):
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def fetch(self, kind, decode, route, **params):
+        # Decoded body of the response; a response that has not changed is not downloaded again, and tables are read
+        # from their columnar copy rather than parsed again
+        params = normalize_params(params)
+        cache_path = None if self.cache_dir is None else self.get_cache_path(kind, route, params)
+
+        etag, cached = (None, None) if cache_path is None else self.read_cache(kind, cache_path, decode)
+        headers = {} if etag is None else {'If-None-Match': etag}
+
+        response = self.get_session().get(self.url + route, params=params, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304 and etag is not None:
+            self.record('revalidated')
+            return cached
+
+        response.raise_for_status()
+
+        value = decode(response.content)
+
+        if cache_path is not None and response.headers.get('ETag'):
+            self.write_cache(kind, cache_path, response.headers['ETag'], response.content, value)
+            self.record('downloaded')
+
+        else:
+            self.record('uncached')
+
+        return value
+
+    def get_content(self, route, **params):
+        return self.fetch('content', bytes, route, **params)
+
+    def get_json(self, route, **params):
+        return self.fetch('json', json.loads, route, **params)
+
+    def get_frame(self, route, **params):
+        # Any route that accepts the orient argument, e.g. /aggregate, /slice, /timeseries or /diff
+        return self.fetch('frame', decode_arrays, route, orient='arrays', **params)
+
+    def get_table(self, table, year, scope='US', **filters):
+        # Filters on the country codes, e.g. affiliate=['FRA', 'DEU'], only apply to the sales mappings; the API rejects
+        # them for the other tables
+        route, params = get_table_request(table, year, scope)
+        decode = decode_batch if route == '/batch' else decode_arrays
+
+        return self.fetch('frame', decode, route, orient='arrays', **params, **filters)
+
+    def get_tables(self, keys, **filters):
+        # Fetches several (table, year, scope) keys concurrently, each with its own cache entry
+        keys = list(keys)
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            tables = executor.map(lambda key: self.get_table(*key, **filters), keys)
+
+            return dict(zip(keys, tables))
@@ -0,0 +1,131 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################################
+# --- Utils
+
+# Each output table is also stored as a directory of .npy files (one per column) described by a small schema file, so
+# that the API can memory-map the data instead of parsing the CSV exports. String columns are dictionary-encoded: the
+# codes and the distinct values are saved as two separate, fixed-width arrays, missing values having the code -1.
+
+SCHEMA_FILE_NAME = 'schema.json'
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_outputs = os.path.join(path_to_dir, 'outputs')
+path_to_columnar_outputs = os.path.join(path_to_outputs, 'columnar')
+
+
+def get_columnar_dir(file_name, path_to_columnar_outputs=path_to_columnar_outputs):
+    return os.path.join(path_to_columnar_outputs, os.path.splitext(file_name)[0])
+
+
+########################################################################################################################
+# --- Writing
+
+def write_columnar(df, path_to_table):
+    # The directory is written next to its final location and renamed at the end, so that readers never see it half
+    # written
+    path_to_tmp = path_to_table + '.tmp'
+
+    if os.path.exists(path_to_tmp):
+        shutil.rmtree(path_to_tmp)
+
+    os.makedirs(path_to_tmp)
+
+    schema = {'n_rows': len(df), 'columns': []}
+
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+
+        if values.dtype == object:
+            missing = pd.isnull(values)
+            categories, inverse = np.unique(values[~missing].astype(str), return_inverse=True)
+
+            codes = np.full(len(values), -1, dtype=np.int16 if len(categories) < np.iinfo(np.int16).max else np.int32)
+            codes[~missing] = inverse
+
+            np.save(os.path.join(path_to_tmp, f'{i}.codes.npy'), codes)
+            np.save(os.path.join(path_to_tmp, f'{i}.categories.npy'), categories)
+
+            schema['columns'].append(
+                {
+                    'name': column,
+                    'dtype': 'object',
+                    'codes': f'{i}.codes.npy',
+                    'categories': f'{i}.categories.npy'
+                }
+            )
+
+        else:
+            np.save(os.path.join(path_to_tmp, f'{i}.npy'), values)
+
+            schema['columns'].append({'name': column, 'dtype': values.dtype.str, 'values': f'{i}.npy'})
+
+    with open(os.path.join(path_to_tmp, SCHEMA_FILE_NAME), 'w') as file:
+        json.dump(schema, file, indent=2)
+
+    if os.path.exists(path_to_table):
+        shutil.rmtree(path_to_table)
+
+    os.rename(path_to_tmp, path_to_table)
+
+
+########################################################################################################################
+# --- Reading
+
+def read_schema(path_to_table):
+    with open(os.path.join(path_to_table, SCHEMA_FILE_NAME)) as file:
+        return json.load(file)
+
+
+def read_columnar(path_to_table, mmap=True, categorical=False):
+    # With categorical=True, string columns are kept dictionary-encoded instead of being expanded into Python objects
+    mmap_mode = 'r' if mmap else None
+
+    schema = read_schema(path_to_table)
+
+    columns = {}
+
+    for column in schema['columns']:
+
+        if column['dtype'] == 'object':
+            codes = np.load(os.path.join(path_to_table, column['codes']), mmap_mode=mmap_mode)
+            categories = np.load(os.path.join(path_to_table, column['categories']))
+
+            if categorical:
+                columns[column['name']] = pd.Categorical.from_codes(codes, categories=categories.astype(object))
+
+            else:
+                # The code -1 picks the missing value appended after the categories
+                columns[column['name']] = np.append(categories.astype(object), np.nan)[codes]
+
+        else:
+            # Numeric columns are kept as read-only views on the memory-mapped files, shared through the page cache
+            columns[column['name']] = np.asarray(
+                np.load(os.path.join(path_to_table, column['values']), mmap_mode=mmap_mode)
+            )
+
+    return pd.DataFrame(columns, columns=[column['name'] for column in schema['columns']], copy=False)
+
+
+########################################################################################################################
+# --- Conversion of the CSV exports
+
+if __name__ == '__main__':
+
+    for file_name in sorted(os.listdir(path_to_outputs)):
+
+        if not file_name.endswith('.csv'):
+            continue
+
+        df = pd.read_csv(os.path.join(path_to_outputs, file_name), float_precision='round_trip')
+        write_columnar(df, get_columnar_dir(file_name))
+
+        print(file_name, '-', 'columnar copy saved!')
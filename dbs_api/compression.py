@@ -0,0 +1,150 @@
+########################################################################################################################
+# --- Imports
+
+import io
+import os
+import gzip
+import hashlib
+
+try:
+    import brotli
+
+except ImportError:
+    brotli = None
+
+from dbs_api.metrics import record_lookup
+
+########################################################################################################################
+# --- Utils
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_compressed_outputs = os.path.join(path_to_dir, 'outputs', 'compressed')
+
+# Content codings by order of preference when the client accepts several of them equally; brotli is optional
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+FILE_EXTENSIONS = {'br': 'br', 'gzip': 'gz'}
+
+# Levels used when the app has to compress a payload itself at startup, chosen to keep the warm-up short, and levels
+# used when the compressed variants are built ahead of time with "python -m dbs_api.compression"
+STARTUP_LEVELS = {'br': 5, 'gzip': 6}
+BUILD_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def compress(payload, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(payload, quality=level)
+
+    if encoding == 'gzip':
+        # A fixed modification time keeps the output deterministic for a given payload (gzip.compress only takes an
+        # mtime argument from Python 3.8)
+        buffer = io.BytesIO()
+
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as file:
+            file.write(payload)
+
+        return buffer.getvalue()
+
+    raise ValueError(f'Unsupported content coding: {encoding}.')
+
+
+########################################################################################################################
+# --- On-disk cache of the compressed payloads
+
+class CompressedPayloadCache:
+    """
+    Stores compressed payloads on disk under the SHA-256 of the uncompressed payload, so that each variant is only
+    compressed once across restarts and gunicorn workers.
+    """
+
+    def __init__(self, path=path_to_compressed_outputs):
+        self.path = path
+
+    def get_file_path(self, payload, encoding):
+        digest = hashlib.sha256(payload).hexdigest()
+
+        return os.path.join(self.path, f'{digest}.{FILE_EXTENSIONS[encoding]}')
+
+    def read(self, payload, encoding):
+        file_path = self.get_file_path(payload, encoding)
+
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, 'rb') as file:
+            return file.read()
+
+    def write(self, payload, encoding, compressed_payload):
+        file_path = self.get_file_path(payload, encoding)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Written to a temporary file and renamed, so that concurrent workers never read a truncated file
+        path_to_tmp = f'{file_path}.{os.getpid()}.tmp'
+
+        with open(path_to_tmp, 'wb') as file:
+            file.write(compressed_payload)
+
+        os.replace(path_to_tmp, file_path)
+
+    def get_or_compress(self, payload, encoding, level=None):
+        compressed_payload = self.read(payload, encoding)
+        record_lookup('compressed_files', compressed_payload is not None)
+
+        if compressed_payload is None:
+            compressed_payload = compress(payload, encoding, STARTUP_LEVELS[encoding] if level is None else level)
+
+            try:
+                self.write(payload, encoding, compressed_payload)
+
+            except OSError:
+                # A read-only deployment can still serve the variants compressed in memory
+                pass
+
+        return compressed_payload
+
+    def prune(self, payloads):
+        # Removes the compressed variants of the payloads other than the given ones, e.g. those of the previous
+        # versions of the outputs; returns the number of files removed
+        kept_file_names = {
+            os.path.basename(self.get_file_path(payload, encoding))
+            for payload in payloads for encoding in FILE_EXTENSIONS
+        }
+
+        if not os.path.isdir(self.path):
+            return 0
+
+        n_removed = 0
+
+        for file_name in os.listdir(self.path):
+            # Temporary files belong to writes in progress
+            if file_name in kept_file_names or file_name.endswith('.tmp'):
+                continue
+
+            try:
+                os.remove(os.path.join(self.path, file_name))
+                n_removed += 1
+
+            except FileNotFoundError:
+                continue
+
+        return n_removed
+
+
+########################################################################################################################
+# --- Build-time compression of the precomputed payloads
+
+if __name__ == '__main__':
+
+    from dbs_api.registry import TableRegistry
+
+    registry = TableRegistry(compress_payloads=False).load()
+    cache = CompressedPayloadCache()
+
+    for key, payload in registry.payloads.items():
+        for encoding in ENCODINGS:
+            cache.write(payload, encoding, compress(payload, encoding, BUILD_LEVELS[encoding]))
+
+        print(*key, '-', 'compressed variants saved!')
+
+    print(cache.prune(registry.payloads.values()), 'compressed variant(s) of previous versions removed')
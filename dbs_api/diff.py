@@ -0,0 +1,127 @@
+########################################################################################################################
+# --- Imports
+
+import numpy as np
+import pandas as pd
+
+from dbs_api.tensor import DEFAULT_PARENT
+
+########################################################################################################################
+# --- Utils
+
+# Columns identifying the rows of each table, on which two selections are matched
+DIFF_KEY_COLUMNS = {
+    'sales_mapping': ['PARENT_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE', 'OTHER_COUNTRY_CODE'],
+    'intermediary_dataframe_1': ['COUNTRY_CODE'],
+    'intermediary_dataframe_2': ['COUNTRY_CODE'],
+    'irs': ['CODE'],
+    'oecd': ['PARENT_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE'],
+}
+
+DIFF_STATUSES = ['added', 'removed', 'changed', 'unchanged']
+
+
+def iter_fixed_pairs(keys):
+    # Comparisons between the output files: each year against the following one, and the restricted scope against the
+    # unrestricted one
+    for table, year, scope in keys:
+
+        if (table, year + 1, scope) in keys:
+            yield (table, year, scope), (table, year + 1, scope)
+
+        if scope == 'global_restricted' and (table, year, 'global_unrestricted') in keys:
+            yield (table, year, scope), (table, year, 'global_unrestricted')
+
+
+def encode_keys(df, key_columns, countries):
+    # Country codes are combined into a single integer, as in the sparse representation of the sales mappings
+    keys = np.zeros(len(df), dtype=np.int64)
+
+    for column in key_columns:
+        if column in df.columns:
+            ids = countries.encode(df[column])
+
+        else:
+            ids = np.full(len(df), countries.encode([DEFAULT_PARENT])[0])
+
+        keys = keys * len(countries) + ids
+
+    return keys
+
+
+def decode_keys(keys, key_columns, countries):
+    columns = {}
+
+    for column in reversed(key_columns):
+        keys, ids = np.divmod(keys, len(countries))
+        columns[column] = countries.decode(ids)
+
+    return {column: columns[column] for column in key_columns}
+
+
+def get_measures(left, right, key_columns):
+    return [
+        column for column in left.columns
+        if column in right.columns and column not in key_columns
+        and pd.api.types.is_numeric_dtype(left[column]) and pd.api.types.is_numeric_dtype(right[column])
+    ]
+
+
+########################################################################################################################
+# --- Differences between two selections of a table
+
+def diff_tables(left, right, table, countries):
+    """
+    Matches the rows of two versions of a table on their keys and returns, for each key of either version, the values
+    of the numeric columns they share, with their absolute and relative changes and the status of the key.
+    """
+    key_columns = DIFF_KEY_COLUMNS[table]
+
+    left_keys = encode_keys(left, key_columns, countries)
+    right_keys = encode_keys(right, key_columns, countries)
+
+    left_order = np.argsort(left_keys, kind='stable')
+    right_order = np.argsort(right_keys, kind='stable')
+
+    # The rows of both versions are located in the sorted union of their keys
+    keys = np.union1d(left_keys, right_keys)
+
+    left_positions = np.searchsorted(keys, left_keys[left_order])
+    right_positions = np.searchsorted(keys, right_keys[right_order])
+
+    in_left = np.zeros(len(keys), dtype=bool)
+    in_left[left_positions] = True
+
+    in_right = np.zeros(len(keys), dtype=bool)
+    in_right[right_positions] = True
+
+    diff = pd.DataFrame(decode_keys(keys, key_columns, countries))
+    changed = np.zeros(len(keys), dtype=bool)
+
+    for measure in get_measures(left, right, key_columns):
+        left_values = np.full(len(keys), np.nan)
+        left_values[left_positions] = left[measure].to_numpy(dtype=np.float64)[left_order]
+
+        right_values = np.full(len(keys), np.nan)
+        right_values[right_positions] = right[measure].to_numpy(dtype=np.float64)[right_order]
+
+        change = right_values - left_values
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_change = np.where(left_values != 0, change / np.abs(left_values), np.nan)
+
+        diff[f'{measure}_LEFT'] = left_values
+        diff[f'{measure}_RIGHT'] = right_values
+        diff[f'{measure}_CHANGE'] = change
+        diff[f'{measure}_RELATIVE_CHANGE'] = relative_change
+
+        changed |= (left_values != right_values) & ~(np.isnan(left_values) & np.isnan(right_values))
+
+    status = np.full(len(keys), 'unchanged', dtype=object)
+    status[changed] = 'changed'
+    status[~in_left] = 'added'
+    status[~in_right] = 'removed'
+
+    diff.insert(len(key_columns), 'STATUS', status)
+
+    return diff
@@ -0,0 +1,80 @@
+########################################################################################################################
+# --- Imports
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################################
+# --- Utils
+
+KEY_COLUMNS = {
+    'parent': 'PARENT_COUNTRY_CODE',
+    'affiliate': 'AFFILIATE_COUNTRY_CODE',
+    'other': 'OTHER_COUNTRY_CODE',
+}
+
+
+########################################################################################################################
+# --- Index on the country code columns
+
+class KeyIndex:
+    """
+    For each key column, stores the permutation that sorts the table on this column and, for each country code, the
+    range of positions that it occupies in this sorted layout. Selecting the rows of one or several codes then costs
+    the size of the selection rather than the size of the table.
+    """
+
+    def __init__(self, table, columns=KEY_COLUMNS.values()):
+        self.n_rows = len(table)
+        self.columns = [column for column in columns if column in table.columns]
+
+        self.values = {}
+        self.ids = {}
+        self.orders = {}
+        self.ranges = {}
+
+        for column in self.columns:
+            # The country codes are factorized, so that the index holds integer arrays only, whether the column is
+            # made of strings or is categorical
+            ids, codes = pd.factorize(table[column], sort=True)
+            order = np.argsort(ids, kind='stable')
+
+            starts = np.searchsorted(ids[order], np.arange(len(codes) + 1))
+
+            self.values[column] = ids
+            self.ids[column] = pd.Index(codes)
+            self.orders[column] = order
+            self.ranges[column] = dict(zip(codes, zip(starts[:-1], starts[1:])))
+
+    def lookup(self, column, codes):
+        order = self.orders[column]
+        ranges = self.ranges[column]
+
+        chunks = [order[slice(*ranges[code])] for code in set(codes) if code in ranges]
+
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.intp)
+
+    def count(self, column, codes):
+        ranges = self.ranges[column]
+
+        return sum(ranges[code][1] - ranges[code][0] for code in set(codes) if code in ranges)
+
+    def select(self, filters):
+        # filters maps key columns to the list of codes to keep; returns the matching row positions, in table order
+        for column in filters:
+            if column not in self.columns:
+                raise KeyError(f'The {column} column is not indexed for this table.')
+
+        if not filters:
+            return np.arange(self.n_rows)
+
+        # We start from the most selective column and check the other conditions on the selected rows only
+        columns = sorted(filters, key=lambda column: self.count(column, filters[column]))
+
+        positions = self.lookup(columns[0], filters[columns[0]])
+
+        for column in columns[1:]:
+            ids = self.ids[column].get_indexer(filters[column])
+            positions = positions[np.isin(self.values[column][positions], ids[ids >= 0])]
+
+        return np.sort(positions)
@@ -0,0 +1,357 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dbs_api.metrics import record_lookup
+from dbs_api.outputs import get_analyses_provider, get_provider_parameters
+from dbs_api.registry import AVAILABLE_YEARS
+
+########################################################################################################################
+# --- Utils
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_custom_outputs = os.path.join(path_to_dir, 'outputs', 'custom')
+
+# Arguments of the analyses providers that clients can set, with their type and, for the global scopes only, the
+# breakdown threshold; the other arguments keep the values used to build the outputs
+CUSTOM_PARAMETERS = {
+    'winsorize_export_percs': bool,
+    'non_US_winsorizing_threshold': float,
+    'US_winsorizing_threshold': float,
+    'macro_indicator': str,
+    'breakdown_threshold': int,
+}
+
+MACRO_INDICATORS = ['CONS', 'GNI']
+
+# Files of a job in the directory shared by the gunicorn workers: its result, its error if it failed, and a marker
+# holding the pid of the worker that runs it while it is pending
+RESULT_EXTENSION = '.json'
+ERROR_EXTENSION = '.error'
+PENDING_EXTENSION = '.pending'
+
+
+def parse_boolean(value):
+    if value.lower() in ['true', '1', 'yes']:
+        return True
+
+    if value.lower() in ['false', '0', 'no']:
+        return False
+
+    raise ValueError(f'{value} is not a boolean.')
+
+
+def normalize_parameters(scope, year, arguments):
+    # Returns the full set of provider arguments, so that equivalent requests share the same key
+    if scope not in AVAILABLE_YEARS or year not in AVAILABLE_YEARS[scope]:
+        raise Exception(f'No sales mapping can be computed for scope={scope} and year={year}.')
+
+    provider_name, parameters = get_provider_parameters(scope, year)
+
+    for name, value in arguments.items():
+
+        if name not in CUSTOM_PARAMETERS:
+            continue
+
+        if name == 'breakdown_threshold' and scope == 'US':
+            raise Exception("The 'breakdown_threshold' argument is only available for the global scopes.")
+
+        try:
+            parse = parse_boolean if CUSTOM_PARAMETERS[name] is bool else CUSTOM_PARAMETERS[name]
+            parameters[name] = parse(value)
+
+        except ValueError:
+            raise Exception(f"The '{name}' argument must be of type {CUSTOM_PARAMETERS[name].__name__}.")
+
+    if parameters['macro_indicator'] not in MACRO_INDICATORS:
+        raise Exception(f"The 'macro_indicator' argument can only take the values: {', '.join(MACRO_INDICATORS)}.")
+
+    for name in ['non_US_winsorizing_threshold', 'US_winsorizing_threshold']:
+        if not 0 <= parameters[name] < 50:
+            raise Exception(f"The '{name}' argument must be a percentage between 0 and 50.")
+
+    # Computations run on the data shipped with the package, never on data downloaded at each request
+    parameters['load_data_online'] = False
+
+    return provider_name, parameters
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+
+    except ProcessLookupError:
+        return False
+
+    except PermissionError:
+        return True
+
+    return True
+
+
+def get_job_id(scope, parameters):
+    return hashlib.sha256(json.dumps([scope, parameters], sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def compute_sales_mapping(scope, parameters):
+    # Runs in the worker processes of the pool
+    year = parameters['year']
+    overrides = {name: value for name, value in parameters.items() if name != 'year'}
+
+    analyses_provider = get_analyses_provider(scope, year, **overrides)
+
+    return analyses_provider.sales_mapping.reset_index(drop=True).to_json().encode('utf-8')
+
+
+########################################################################################################################
+# --- Pool of computations with a bounded cache
+
+class ComputationPool:
+    """
+    Runs the custom computations on a pool of processes, so that the web workers are never blocked, and caches their
+    results in a bounded LRU cache in memory, backed by a bounded directory on disk that the gunicorn workers share.
+    The identifier of a job is derived from its normalized parameters: identical requests are merged into one job,
+    across the workers too, since the pending jobs and the failures are also recorded in the shared directory.
+    """
+
+    def __init__(
+        self, compute=compute_sales_mapping, max_workers=2, max_cached_results=16, max_disk_results=128,
+        path=path_to_custom_outputs
+    ):
+        self.compute = compute
+        self.max_workers = max_workers
+        self.max_cached_results = max_cached_results
+        self.max_disk_results = max_disk_results
+        self.path = path
+
+        self.executor = None
+        self.lock = threading.Lock()
+
+        self.results = OrderedDict()
+        self.pending = {}
+        self.errors = OrderedDict()
+
+    def get_executor(self):
+        # The pool is only started with the first job, hence after gunicorn has forked the workers
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        return self.executor
+
+    def get_file_path(self, job_id, extension=RESULT_EXTENSION):
+        return os.path.join(self.path, f'{job_id}{extension}')
+
+    def store(self, job_id, payload):
+        self.results[job_id] = payload
+        self.results.move_to_end(job_id)
+
+        while len(self.results) > self.max_cached_results:
+            self.results.popitem(last=False)
+
+    def store_error(self, job_id, error):
+        self.errors[job_id] = error
+        self.errors.move_to_end(job_id)
+
+        while len(self.errors) > self.max_cached_results:
+            self.errors.popitem(last=False)
+
+    def write_to_disk(self, job_id, payload, extension=RESULT_EXTENSION):
+        os.makedirs(self.path, exist_ok=True)
+
+        path_to_tmp = f'{self.get_file_path(job_id, extension)}.{os.getpid()}.tmp'
+
+        with open(path_to_tmp, 'wb') as file:
+            file.write(payload)
+
+        os.replace(path_to_tmp, self.get_file_path(job_id, extension))
+
+        # Least recently used results and errors are evicted from the disk as well, based on their access times
+        file_paths = [
+            os.path.join(self.path, file_name) for file_name in os.listdir(self.path)
+            if file_name.endswith(extension)
+        ]
+
+        for file_path in sorted(file_paths, key=os.path.getatime)[:max(len(file_paths) - self.max_disk_results, 0)]:
+            os.remove(file_path)
+
+    def read_from_disk(self, job_id, extension=RESULT_EXTENSION):
+        file_path = self.get_file_path(job_id, extension)
+
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, 'rb') as file:
+            payload = file.read()
+
+        # Reading a file does not always update its access time, depending on how the disk is mounted
+        os.utime(file_path)
+
+        return payload
+
+    def remove_from_disk(self, job_id, extension):
+        try:
+            os.remove(self.get_file_path(job_id, extension))
+
+        except FileNotFoundError:
+            pass
+
+    def create_marker(self, job_id):
+        # Returns True if this worker now owns the job, False if another live process is running it; markers left by
+        # the processes that died are replaced
+        os.makedirs(self.path, exist_ok=True)
+
+        for _ in range(2):
+            try:
+                flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                descriptor = os.open(self.get_file_path(job_id, PENDING_EXTENSION), flags)
+
+            except FileExistsError:
+                if self.is_marked_pending(job_id):
+                    return False
+
+                self.remove_from_disk(job_id, PENDING_EXTENSION)
+                continue
+
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(str(os.getpid()))
+
+            return True
+
+        return False
+
+    def is_marked_pending(self, job_id):
+        try:
+            with open(self.get_file_path(job_id, PENDING_EXTENSION)) as file:
+                pid = int(file.read())
+
+        except FileNotFoundError:
+            return False
+
+        except ValueError:
+            # The marker is being written
+            return True
+
+        return is_alive(pid)
+
+    def on_done(self, job_id, future):
+        with self.lock:
+            self.pending.pop(job_id, None)
+
+            if future.exception() is not None:
+                error = repr(future.exception())
+                self.store_error(job_id, error)
+
+            else:
+                error = None
+                payload = future.result()
+                self.store(job_id, payload)
+
+        # The result or the error is written before the marker is removed, so that the other workers always find one
+        # of them
+        try:
+            if error is None:
+                self.write_to_disk(job_id, payload)
+
+            else:
+                self.write_to_disk(job_id, error.encode('utf-8'), ERROR_EXTENSION)
+
+        except OSError:
+            pass
+
+        self.remove_from_disk(job_id, PENDING_EXTENSION)
+
+    def submit_to_executor(self, scope, parameters):
+        try:
+            return self.get_executor().submit(self.compute, scope, parameters)
+
+        except BrokenProcessPool:
+            # A process of the pool that died, e.g. killed for its memory use, breaks the whole pool, which is replaced
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+            return self.executor.submit(self.compute, scope, parameters)
+
+    def submit(self, scope, parameters):
+        job_id = get_job_id(scope, parameters)
+
+        with self.lock:
+            if job_id in self.results or job_id in self.pending:
+                record_lookup('custom_results', True)
+                return job_id
+
+            payload = self.read_from_disk(job_id)
+            record_lookup('custom_results', payload is not None)
+
+            if payload is not None:
+                self.store(job_id, payload)
+                return job_id
+
+            # The job is already running in another gunicorn worker
+            if not self.create_marker(job_id):
+                return job_id
+
+            # A failed job is retried when it is submitted again
+            self.errors.pop(job_id, None)
+            self.remove_from_disk(job_id, ERROR_EXTENSION)
+
+            try:
+                future = self.submit_to_executor(scope, parameters)
+
+            except Exception:
+                self.remove_from_disk(job_id, PENDING_EXTENSION)
+                raise
+
+            self.pending[job_id] = future
+
+        future.add_done_callback(lambda future: self.on_done(job_id, future))
+
+        return job_id
+
+    def get_status(self, job_id):
+        with self.lock:
+            if job_id in self.results:
+                return 'done'
+
+            if job_id in self.pending:
+                return 'pending'
+
+        # The job may have been computed by another gunicorn worker or evicted from memory only
+        payload = self.read_from_disk(job_id)
+
+        if payload is not None:
+            with self.lock:
+                self.store(job_id, payload)
+
+            return 'done'
+
+        if self.is_marked_pending(job_id):
+            return 'pending'
+
+        if job_id in self.errors or os.path.exists(self.get_file_path(job_id, ERROR_EXTENSION)):
+            return 'failed'
+
+        return 'unknown'
+
+    def get_result(self, job_id):
+        with self.lock:
+            if job_id in self.results:
+                self.results.move_to_end(job_id)
+
+                return self.results[job_id]
+
+        return self.read_from_disk(job_id)
+
+    def get_error(self, job_id):
+        if job_id in self.errors:
+            return self.errors[job_id]
+
+        error = self.read_from_disk(job_id, ERROR_EXTENSION)
+
+        return None if error is None else error.decode('utf-8')
@@ -0,0 +1,223 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import json
+import time
+import bisect
+import threading
+
+########################################################################################################################
+# --- Utils
+
+# Upper bounds of the histogram buckets, in seconds for the durations and in bytes for the response sizes
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [100, 1000, 10000, 100000, 1000000, 10000000, 100000000]
+
+# With several gunicorn workers, each of them saves its metrics in this directory, at most every
+# SNAPSHOT_INTERVAL seconds, and /metrics adds up those of all the live workers
+METRICS_DIR = os.environ.get('DBS_API_METRICS_DIR')
+SNAPSHOT_INTERVAL = 1
+
+
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ''
+
+    labels = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(label_names, label_values)
+    )
+
+    return '{' + labels + '}'
+
+
+########################################################################################################################
+# --- Metrics
+
+class Counter:
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = list(label_names)
+
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {json.dumps(labels): value for labels, value in self.values.items()}
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def render(self, values):
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.label_names, json.loads(labels))} {value}'
+
+
+class Histogram:
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = list(label_names)
+        self.buckets = list(buckets)
+
+        # For each combination of labels: the count of each bucket (non-cumulative, the last one being +Inf), the sum
+        # and the count of the observations
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts, total, count = self.values.get(label_values, ([0] * (len(self.buckets) + 1), 0, 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+
+            self.values[label_values] = (counts, total + value, count + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                json.dumps(labels): [list(counts), total, count]
+                for labels, (counts, total, count) in self.values.items()
+            }
+
+    @staticmethod
+    def merge(value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    def render(self, values):
+        for labels, (counts, total, count) in sorted(values.items()):
+            labels = json.loads(labels)
+            cumulative = 0
+
+            for bound, bucket_count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{format_labels(self.label_names + ['le'], labels + [bound])} {cumulative}"
+
+            yield f'{self.name}_sum{format_labels(self.label_names, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.label_names, labels)} {count}'
+
+
+class MetricsRegistry:
+    """
+    Minimal implementation of the Prometheus counters and histograms, exposed in the text exposition format. The
+    metrics of the other gunicorn workers are read from the snapshots that they save in a shared directory, if any.
+    """
+
+    def __init__(self, path=METRICS_DIR):
+        self.path = path
+        self.metrics = []
+
+        self.last_snapshot = 0
+
+    def counter(self, *args, **kwargs):
+        self.metrics.append(Counter(*args, **kwargs))
+
+        return self.metrics[-1]
+
+    def histogram(self, *args, **kwargs):
+        self.metrics.append(Histogram(*args, **kwargs))
+
+        return self.metrics[-1]
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def save_snapshot(self, force=False):
+        if self.path is None or (not force and time.monotonic() - self.last_snapshot < SNAPSHOT_INTERVAL):
+            return
+
+        self.last_snapshot = time.monotonic()
+
+        os.makedirs(self.path, exist_ok=True)
+
+        file_path = os.path.join(self.path, f'{os.getpid()}.json')
+
+        with open(file_path + '.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+
+        os.replace(file_path + '.tmp', file_path)
+
+    def read_snapshots(self):
+        # Snapshots of the other live processes; those of the workers that exited are ignored
+        snapshots = []
+
+        if self.path is None or not os.path.isdir(self.path):
+            return snapshots
+
+        for file_name in os.listdir(self.path):
+            pid, extension = os.path.splitext(file_name)
+
+            if extension != '.json':
+                continue
+
+            # Other files of the directory are ignored
+            try:
+                if int(pid) == os.getpid():
+                    continue
+
+                os.kill(int(pid), 0)
+
+                with open(os.path.join(self.path, file_name)) as file:
+                    snapshots.append(json.load(file))
+
+            except (OSError, ValueError):
+                continue
+
+        return snapshots
+
+    def render(self):
+        snapshots = [self.snapshot()] + self.read_snapshots()
+
+        lines = []
+
+        for metric in self.metrics:
+            values = {}
+
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(metric.name, {}).items():
+                    values[labels] = metric.merge(values[labels], value) if labels in values else value
+
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render(values))
+
+        return '\n'.join(lines) + '\n'
+
+
+########################################################################################################################
+# --- Metrics of the API
+
+metrics_registry = MetricsRegistry()
+
+REQUEST_DURATION = metrics_registry.histogram(
+    'dbs_api_request_duration_seconds', 'Duration of the requests, until the response is sent', ['route', 'status']
+)
+PHASE_DURATION = metrics_registry.histogram(
+    'dbs_api_request_phase_duration_seconds', 'Duration of each phase of the requests', ['route', 'phase']
+)
+RESPONSE_SIZE = metrics_registry.histogram(
+    'dbs_api_response_size_bytes', 'Size of the response bodies', ['route'], buckets=SIZE_BUCKETS
+)
+CACHE_LOOKUPS = metrics_registry.counter(
+    'dbs_api_cache_lookups_total', 'Lookups in the caches of the API, by cache and result', ['cache', 'result']
+)
+SLOW_REQUEST_PROFILES = metrics_registry.counter(
+    'dbs_api_slow_request_profiles_total', 'Profiles saved for slow requests', ['route']
+)
+
+
+def record_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache, 'hit' if hit else 'miss')
@@ -1,122 +1,280 @@
 import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dbs_api.columnar import write_columnar, get_columnar_dir
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_outputs = os.path.join(path_to_dir, 'outputs')
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+COMBINATIONS = [
+    ('US', 2016), ('US', 2017), ('US', 2018), ('US', 2019),
+    ('global_restricted', 2016), ('global_restricted', 2017),
+    ('global_unrestricted', 2016), ('global_unrestricted', 2017),
+]
+
+
+def get_provider_parameters(scope, year):
+    # Returns the name of the analyses provider class and the arguments with which it is instantiated
+    parameters = dict(
+        year=year,
+        US_merchandise_exports_source='Comtrade',
+        US_services_exports_source='BaTIS',
+        non_US_merchandise_exports_source='Comtrade',
+        non_US_services_exports_source='BaTIS',
+        winsorize_export_percs=True,
+        non_US_winsorizing_threshold=0.5,
+        US_winsorizing_threshold=0.5,
+        service_flows_to_exclude=[],
+        macro_indicator='CONS',
+        load_data_online=False
+    )
+
+    if scope == 'US':
+        return 'USAnalysesProvider', parameters
+
+    parameters['aamne_domestic_sales_perc'] = True
+    parameters['breakdown_threshold'] = 60 if scope == 'global_restricted' else 0
+
+    return 'GlobalAnalysesProvider', parameters
+
+
+def get_parameters_hash(scope, year):
+    provider_name, parameters = get_provider_parameters(scope, year)
+
+    return hashlib.sha256(
+        json.dumps([provider_name, parameters], sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def get_package_version():
+    # Version of the upstream destination_based_sales package, completed with the commit when installed from git
+    try:
+        from importlib import metadata
+
+    except ImportError:
+        import importlib_metadata as metadata
+
+    try:
+        distribution = metadata.distribution('destination-based-sales')
+
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+    version = distribution.version
+    direct_url = distribution.read_text('direct_url.json')
+
+    if direct_url:
+        commit_id = json.loads(direct_url).get('vcs_info', {}).get('commit_id')
+
+        if commit_id:
+            version += '+' + commit_id
+
+    return version
+
+
+def get_file_names(scope, year):
+    file_names = [
+        f'sales_mapping_{scope}_{year}.csv',
+        f'intermediary_dataframe_1_{scope}_{year}.csv',
+        f'intermediary_dataframe_2_{scope}_{year}.csv',
+    ]
+
+    if scope == 'US':
+        file_names.append(f'irs_{year}.csv')
+
+    else:
+        scope_suffix = scope.split('_')[1]
+        file_names.append(f'oecd_{year}_{scope_suffix}.csv')
+
+    return file_names
+
+
+def get_output_paths(scope, year):
+    # Paths, relative to the outputs directory, of the CSV exports and of their columnar copies
+    file_names = get_file_names(scope, year)
+
+    return file_names + [get_columnar_dir(file_name, 'columnar') for file_name in file_names]
+
+
+def read_manifest(path_to_outputs=path_to_outputs):
+    path_to_manifest = os.path.join(path_to_outputs, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(path_to_manifest):
+        return {'combinations': {}}
+
+    with open(path_to_manifest) as file:
+        return json.load(file)
+
+
+def write_manifest(manifest, path_to_outputs=path_to_outputs):
+    # The manifest is replaced atomically, so that readers always see a complete version of it
+    path_to_manifest = os.path.join(path_to_outputs, MANIFEST_FILE_NAME)
+    path_to_tmp = path_to_manifest + '.tmp'
+
+    with open(path_to_tmp, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    os.replace(path_to_tmp, path_to_manifest)
+
+
+def publish_version(manifest, path_to_outputs=path_to_outputs):
+    # Running APIs reload the tables when the version changes, hence only once all the output files are complete
+    manifest['version'] = uuid.uuid4().hex
+    write_manifest(manifest, path_to_outputs)
+
+    return manifest['version']
+
+
+def is_up_to_date(manifest, scope, year, package_version, path_to_outputs=path_to_outputs):
+    entry = manifest['combinations'].get(f'{scope}_{year}')
+
+    if entry is None:
+        return False
+
+    return (
+        entry['parameters_hash'] == get_parameters_hash(scope, year)
+        and entry['package_version'] == package_version
+        and all(os.path.exists(os.path.join(path_to_outputs, file_name)) for file_name in entry['files'])
+    )
+
+
+def save_output(df, path_to_outputs, file_name):
+    # The CSV file remains the human-readable export and the columnar copy is the one memory-mapped by the API
+    df = df.reset_index(drop=True)
+
+    path_to_file = os.path.join(path_to_outputs, file_name)
+
+    df.to_csv(path_to_file + '.tmp', index=False)
+    os.replace(path_to_file + '.tmp', path_to_file)
+
+    write_columnar(df, get_columnar_dir(file_name, os.path.join(path_to_outputs, 'columnar')))
+
+
+def get_analyses_provider(scope, year, **parameter_overrides):
+    from destination_based_sales import analyses_provider as module
+
+    provider_name, parameters = get_provider_parameters(scope, year)
+    parameters.update(parameter_overrides)
+
+    return getattr(module, provider_name)(**parameters)
+
+
+def build_combination(scope, year, path_to_outputs=path_to_outputs):
+    start = time.perf_counter()
+
+    analyses_provider = get_analyses_provider(scope, year)
+
+    sales_mapping_file, intermediary_df_1_file, intermediary_df_2_file, last_file = get_file_names(scope, year)
+
+    sales_mapping = analyses_provider.sales_mapping.copy()
+    save_output(sales_mapping, path_to_outputs, sales_mapping_file)
+
+    if scope == 'US':
+        intermediary_df_1 = analyses_provider.get_intermediary_dataframe_1(
+            include_macro_indicator=True
+        )
+        save_output(intermediary_df_1, path_to_outputs, intermediary_df_1_file)
+
+        intermediary_df_2 = analyses_provider.get_intermediary_dataframe_2(
+            include_macro_indicator=True
+        )
+        save_output(intermediary_df_2, path_to_outputs, intermediary_df_2_file)
+
+        irs = analyses_provider.irs.copy()
+        save_output(irs, path_to_outputs, last_file)
+
+    else:
+        intermediary_df_1 = analyses_provider.get_intermediary_dataframe_1(
+            exclude_US_from_parents=False,
+            include_macro_indicator=True,
+        )
+        save_output(intermediary_df_1, path_to_outputs, intermediary_df_1_file)
+
+        intermediary_df_2 = analyses_provider.get_intermediary_dataframe_2(
+            exclude_US_from_parents=False,
+            include_macro_indicator=True
+        )
+        save_output(intermediary_df_2, path_to_outputs, intermediary_df_2_file)
+
+        oecd = analyses_provider.oecd.copy()
+        save_output(oecd, path_to_outputs, last_file)
+
+    return time.perf_counter() - start
 
-from destination_based_sales.analyses_provider import USAnalysesProvider, GlobalAnalysesProvider
 
 if __name__ == '__main__':
 
-    path_to_dir = os.path.dirname(os.path.abspath(__file__))
-    path_to_outputs = os.path.join(path_to_dir, 'outputs')
-
-    for scope in ['US', 'global_restricted', 'global_unrestricted']:
-        available_years = [2016, 2017, 2018, 2019] if scope == 'US' else [2016, 2017]
-
-        for year in available_years:
-
-            print(scope, '-', year, '-', 'loading the data...')
-
-            if scope == 'US':
-                analyses_provider = USAnalysesProvider(
-                    year=year,
-                    US_merchandise_exports_source='Comtrade',
-                    US_services_exports_source='BaTIS',
-                    non_US_merchandise_exports_source='Comtrade',
-                    non_US_services_exports_source='BaTIS',
-                    winsorize_export_percs=True,
-                    non_US_winsorizing_threshold=0.5,
-                    US_winsorizing_threshold=0.5,
-                    service_flows_to_exclude=[],
-                    macro_indicator='CONS',
-                    load_data_online=False
-                )
-
-            elif scope == 'global_restricted':
-                analyses_provider = GlobalAnalysesProvider(
-                    year=year,
-                    aamne_domestic_sales_perc=True,
-                    breakdown_threshold=60,
-                    US_merchandise_exports_source='Comtrade',
-                    US_services_exports_source='BaTIS',
-                    non_US_merchandise_exports_source='Comtrade',
-                    non_US_services_exports_source='BaTIS',
-                    winsorize_export_percs=True,
-                    non_US_winsorizing_threshold=0.5,
-                    US_winsorizing_threshold=0.5,
-                    service_flows_to_exclude=[],
-                    macro_indicator='CONS',
-                    load_data_online=False
-                )
-
-            else:
-                analyses_provider = GlobalAnalysesProvider(
-                    year=year,
-                    aamne_domestic_sales_perc=True,
-                    breakdown_threshold=0,
-                    US_merchandise_exports_source='Comtrade',
-                    US_services_exports_source='BaTIS',
-                    non_US_merchandise_exports_source='Comtrade',
-                    non_US_services_exports_source='BaTIS',
-                    winsorize_export_percs=True,
-                    non_US_winsorizing_threshold=0.5,
-                    US_winsorizing_threshold=0.5,
-                    service_flows_to_exclude=[],
-                    macro_indicator='CONS',
-                    load_data_online=False
-                )
-
-            sales_mapping = analyses_provider.sales_mapping.copy()
-            sales_mapping.to_csv(
-                os.path.join(path_to_outputs, f'sales_mapping_{scope}_{year}.csv'),
-                index=False
-            )
-
-            if scope == 'US':
-                intermediary_df_1 = analyses_provider.get_intermediary_dataframe_1(
-                    include_macro_indicator=True
-                )
-                intermediary_df_1.to_csv(
-                    os.path.join(path_to_outputs, f'intermediary_dataframe_1_{scope}_{year}.csv'),
-                    index=False
-                )
-
-                intermediary_df_2 = analyses_provider.get_intermediary_dataframe_2(
-                    include_macro_indicator=True
-                )
-                intermediary_df_2.to_csv(
-                    os.path.join(path_to_outputs, f'intermediary_dataframe_2_{scope}_{year}.csv'),
-                    index=False
-                )
-
-                irs = analyses_provider.irs.copy()
-                irs.to_csv(
-                    os.path.join(path_to_outputs, f'irs_{year}.csv'),
-                    index=False
-                )
-
-            else:
-                intermediary_df_1 = analyses_provider.get_intermediary_dataframe_1(
-                    exclude_US_from_parents=False,
-                    include_macro_indicator=True,
-                )
-                intermediary_df_1.to_csv(
-                    os.path.join(path_to_outputs, f'intermediary_dataframe_1_{scope}_{year}.csv'),
-                    index=False
-                )
-
-                intermediary_df_2 = analyses_provider.get_intermediary_dataframe_2(
-                    exclude_US_from_parents=False,
-                    include_macro_indicator=True
-                )
-                intermediary_df_2.to_csv(
-                    os.path.join(path_to_outputs, f'intermediary_dataframe_2_{scope}_{year}.csv'),
-                    index=False
-                )
-
-                oecd = analyses_provider.oecd.copy()
-                scope_suffix = scope.split('_')[1]
-                oecd.to_csv(
-                    os.path.join(path_to_outputs, f'oecd_{year}_{scope_suffix}.csv'),
-                    index=False
-                )
-
-            print(scope, '-', year, '-', 'files saved!')
-            print('------------------------------------')
+    parser = argparse.ArgumentParser(description='Computes the output tables served by the API.')
+    parser.add_argument('--jobs', type=int, default=1, help='number of combinations computed in parallel')
+    parser.add_argument('--force', action='store_true', help='recompute the combinations that are up to date')
+
+    args = parser.parse_args()
+
+    manifest = read_manifest()
+    package_version = get_package_version()
+
+    combinations = [
+        (scope, year) for scope, year in COMBINATIONS
+        if args.force or not is_up_to_date(manifest, scope, year, package_version)
+    ]
+
+    for scope, year in COMBINATIONS:
+        if (scope, year) not in combinations:
+            print(scope, '-', year, '-', 'up to date, skipped')
+
+    start = time.perf_counter()
+    n_failed = 0
+
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        futures = {executor.submit(build_combination, scope, year): (scope, year) for scope, year in combinations}
+
+        for future in as_completed(futures):
+            scope, year = futures[future]
+
+            try:
+                duration = future.result()
+
+            except Exception as exception:
+                print(scope, '-', year, '-', 'failed:', repr(exception))
+                n_failed += 1
+                continue
+
+            # The manifest is updated as soon as a combination is saved, so that an interrupted build resumes
+            manifest['combinations'][f'{scope}_{year}'] = {
+                'parameters_hash': get_parameters_hash(scope, year),
+                'package_version': package_version,
+                'files': get_output_paths(scope, year),
+                'duration': round(duration, 1),
+            }
+            write_manifest(manifest)
+
+            print(scope, '-', year, '-', f'files saved in {duration:.1f}s!')
+
+    if n_failed:
+        # The running apps keep serving the current version, which is only replaced by a complete set of tables
+        print('Version not published, since some combinations failed')
+
+    elif combinations:
+        # The new payloads are compressed first, so that the running apps find them in the on-disk cache when they
+        # reload the tables, and the variants of the previous versions are removed from the cache
+        from dbs_api.registry import TableRegistry
+        TableRegistry().load().compress_all()
+
+        print('Version', publish_version(manifest), 'published')
+
+    print('------------------------------------')
+    print(
+        f'{len(combinations) - n_failed} combination(s) computed and {n_failed} failed',
+        f'in {time.perf_counter() - start:.1f}s'
+    )
+
+    sys.exit(1 if n_failed else 0)
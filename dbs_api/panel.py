@@ -0,0 +1,49 @@
+########################################################################################################################
+# --- Imports
+
+import numpy as np
+import pandas as pd
+
+from dbs_api.aggregation import METRICS
+from dbs_api.tensor import SparseCountryArray
+
+
+########################################################################################################################
+# --- Panel of the sales mappings across years
+
+class SalesPanel(SparseCountryArray):
+    """
+    Aligns the sales mappings of one scope across all their years: the union of the (parent, affiliate, other country)
+    keys, encoded with the shared country dictionary, indexes a dense array of shape (keys, years, measures) in which
+    the years where a key is not observed hold NaN.
+    """
+
+    def __init__(self, tensors, countries):
+        # tensors maps years to the SalesTensor of the corresponding sales mappings
+        super().__init__(countries)
+
+        self.years = sorted(tensors)
+
+        keys = np.unique(np.concatenate([tensors[year].keys for year in self.years]))
+        self.set_keys(keys)
+
+        self.values = np.full((len(keys), len(self.years), len(METRICS)), np.nan)
+
+        for i, year in enumerate(self.years):
+            self.values[np.searchsorted(keys, tensors[year].keys), i, :] = tensors[year].values
+
+    def lookup(self, filters, metrics):
+        # Returns the panel in long format, with one row per key and year
+        positions = self.select(filters)
+
+        panel = pd.DataFrame({
+            column: np.repeat(codes, len(self.years)) for column, codes in self.decode_keys(positions).items()
+        })
+        panel['YEAR'] = np.tile(self.years, len(positions))
+
+        values = self.values[positions].reshape(-1, len(METRICS))
+
+        for metric in metrics:
+            panel[metric] = values[:, METRICS.index(metric)]
+
+        return panel
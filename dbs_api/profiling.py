@@ -0,0 +1,115 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import sys
+import time
+import threading
+
+from collections import Counter
+
+########################################################################################################################
+# --- Utils
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_profiles = os.path.join(path_to_dir, 'outputs', 'profiles')
+
+# The profiler is off unless DBS_API_PROFILE_THRESHOLD gives the duration, in seconds, above which a request is slow
+PROFILE_THRESHOLD = os.environ.get('DBS_API_PROFILE_THRESHOLD')
+PROFILE_INTERVAL = float(os.environ.get('DBS_API_PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('DBS_API_PROFILE_DIR', path_to_profiles)
+
+# Only the most recent profiles are kept, the oldest ones being deleted as new ones are written
+MAX_PROFILES = int(os.environ.get('DBS_API_MAX_PROFILES', 100))
+
+
+def format_stack(frame):
+    # Collapsed stack, from the outermost frame to the innermost one, as read by flame graph tools
+    functions = []
+
+    while frame is not None:
+        code = frame.f_code
+        functions.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+
+    return ';'.join(reversed(functions))
+
+
+########################################################################################################################
+# --- Sampling profiler of the slow requests
+
+class SamplingProfiler:
+    """
+    Samples, every interval seconds, the stacks of the threads that are serving a request, from a single background
+    thread, so that the requests themselves are not slowed down by any tracing. The samples of a request that turns
+    out to be slow are saved in the collapsed format of flame graphs; the others are discarded.
+    """
+
+    def __init__(self, threshold, interval=PROFILE_INTERVAL, path=PROFILE_DIR, max_profiles=MAX_PROFILES):
+        self.threshold = threshold
+        self.interval = interval
+        self.path = path
+        self.max_profiles = max_profiles
+
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        # The sampling thread is started with the first request, hence in each gunicorn worker after the fork
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            frames = sys._current_frames()
+
+            with self.lock:
+                for thread_id, samples in self.samples.items():
+                    if thread_id in frames:
+                        samples[format_stack(frames[thread_id])] += 1
+
+    def begin(self):
+        self.start()
+
+        with self.lock:
+            self.samples[threading.get_ident()] = Counter()
+
+    def end(self, duration, name):
+        # Returns the path to the profile if the request was slow
+        with self.lock:
+            samples = self.samples.pop(threading.get_ident(), None)
+
+        if not samples or duration < self.threshold:
+            return None
+
+        os.makedirs(self.path, exist_ok=True)
+
+        file_path = os.path.join(self.path, f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{name}.folded')
+
+        with open(file_path, 'w') as file:
+            file.write(f'# {name} {duration * 1000:.1f} ms, sampled every {self.interval * 1000:.1f} ms\n')
+
+            for stack, count in samples.most_common():
+                file.write(f'{stack} {count}\n')
+
+        self.prune()
+
+        return file_path
+
+    def prune(self):
+        file_paths = [
+            os.path.join(self.path, file_name) for file_name in os.listdir(self.path) if file_name.endswith('.folded')
+        ]
+
+        for file_path in sorted(file_paths, key=os.path.getmtime)[:max(len(file_paths) - self.max_profiles, 0)]:
+            # The profiles are shared by the gunicorn workers, which may delete the same file at once
+            try:
+                os.remove(file_path)
+
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,98 @@
+########################################################################################################################
+# --- Imports
+
+import numpy as np
+import pandas as pd
+
+########################################################################################################################
+# --- Utils
+
+ORDERS = ['desc', 'asc']
+
+# Column within which the rows are also ranked, for the tables that have it
+GROUP_COLUMN = 'PARENT_COUNTRY_CODE'
+
+
+########################################################################################################################
+# --- Sort orders of the numeric columns
+
+class RankingIndex:
+    """
+    For each numeric column of a table and each direction, stores the permutation that sorts the table on this column
+    (missing values last, ties in table order) and the rank of each row. For the tables with a parent column, the rows
+    are also sorted within each parent country, so that the top rows of one parent are read from a contiguous range.
+    """
+
+    def __init__(self, table):
+        self.measures = [column for column in table.columns if pd.api.types.is_numeric_dtype(table[column])]
+
+        self.orders = {}
+        self.ranks = {}
+        self.group_ranges = {}
+
+        if GROUP_COLUMN in table.columns:
+            groups = table[GROUP_COLUMN].to_numpy()
+            self.group_codes, self.group_ids = np.unique(groups, return_inverse=True)
+
+        else:
+            self.group_codes = None
+
+        for measure in self.measures:
+            values = table[measure].to_numpy(dtype=np.float64)
+
+            for order in ORDERS:
+                permutation = np.argsort(values if order == 'asc' else -values, kind='stable').astype(np.int32)
+
+                ranks = np.empty_like(permutation)
+                ranks[permutation] = np.arange(len(permutation), dtype=np.int32)
+
+                self.orders[(measure, order)] = permutation
+                self.ranks[(measure, order)] = ranks
+
+                if self.group_codes is not None:
+                    self.group_orders(measure, order)
+
+    def group_orders(self, measure, order):
+        # The global order is stably sorted on the parent, which keeps the rows of each parent in the measure order
+        permutation = self.orders[(measure, order)]
+        grouped = permutation[np.argsort(self.group_ids[permutation], kind='stable')]
+
+        starts = np.searchsorted(self.group_ids[grouped], np.arange(len(self.group_codes) + 1))
+
+        self.orders[(measure, order, GROUP_COLUMN)] = grouped
+        self.group_ranges[(measure, order)] = dict(zip(self.group_codes, zip(starts[:-1], starts[1:])))
+
+    def check_measure(self, measure, order):
+        if measure not in self.measures:
+            raise Exception(
+                f"Cannot sort by {measure}. Available columns for this table are: {', '.join(self.measures)}."
+            )
+
+        if order not in ORDERS:
+            raise Exception(f"The 'order' argument can only take the following values: {', '.join(ORDERS)}.")
+
+    def sort(self, measure, order, positions):
+        # Sorts a selection of rows, in time proportional to the size of the selection
+        self.check_measure(measure, order)
+
+        return positions[np.argsort(self.ranks[(measure, order)][positions], kind='stable')]
+
+    def top(self, measure, order, n=None, groups=None):
+        # Positions of the n first rows, among those of the given parent countries if any
+        self.check_measure(measure, order)
+
+        if groups is None:
+            return self.orders[(measure, order)][:n]
+
+        ranges = self.group_ranges[(measure, order)]
+        grouped = self.orders[(measure, order, GROUP_COLUMN)]
+
+        chunks = [grouped[start:stop][:n] for start, stop in (ranges[code] for code in set(groups) if code in ranges)]
+
+        if not chunks:
+            return np.empty(0, dtype=np.int32)
+
+        if len(chunks) == 1:
+            return chunks[0]
+
+        return self.sort(measure, order, np.concatenate(chunks))[:n]
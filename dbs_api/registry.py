@@ -0,0 +1,368 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import time
+import hashlib
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from dbs_api.aggregation import SalesMappingAggregator, build_continent_mapping
+from dbs_api.columnar import read_columnar, get_columnar_dir
+from dbs_api.compression import CompressedPayloadCache, ENCODINGS
+from dbs_api.diff import diff_tables, iter_fixed_pairs
+from dbs_api.indexes import KeyIndex, KEY_COLUMNS
+from dbs_api.metrics import record_lookup
+from dbs_api.outputs import read_manifest
+from dbs_api.panel import SalesPanel
+from dbs_api.ranking import RankingIndex, GROUP_COLUMN
+from dbs_api.schemas import validate_table, apply_schema
+from dbs_api.serialization import to_json, encode_arrays, DEFAULT_PRECISION
+from dbs_api.tensor import CountryDictionary, SalesTensor, DEFAULT_PARENT
+
+########################################################################################################################
+# --- Catalogue of the output tables
+
+path_to_dir = os.path.dirname(os.path.abspath(__file__))
+path_to_outputs = os.path.join(path_to_dir, 'outputs')
+
+AVAILABLE_YEARS = {
+    'US': [2016, 2017, 2018, 2019],
+    'global_restricted': [2016, 2017],
+    'global_unrestricted': [2016, 2017],
+}
+
+TABLE_NAMES = ['sales_mapping', 'intermediary_dataframe_1', 'intermediary_dataframe_2', 'irs', 'oecd']
+
+# Tables on which the routes accept filters on the country code columns
+INDEXED_TABLE_NAMES = ['sales_mapping']
+
+# (orient, precision) combinations whose payloads are serialized at load time, the others being serialized on demand
+PRECOMPUTED_VARIANTS = [
+    ('columns', DEFAULT_PRECISION),
+    ('split', DEFAULT_PRECISION),
+    ('arrays', DEFAULT_PRECISION),
+]
+
+
+def get_file_name(table, year, scope):
+    # The IRS data only exist for US multinationals and the OECD data only for the global scopes
+    if table == 'irs':
+        return f'irs_{year}.csv'
+
+    if table == 'oecd':
+        scope_suffix = scope.split('_')[1]
+        return f'oecd_{year}_{scope_suffix}.csv'
+
+    return f'{table}_{scope}_{year}.csv'
+
+
+def iter_table_keys():
+    for scope, available_years in AVAILABLE_YEARS.items():
+        for year in available_years:
+            for table in TABLE_NAMES:
+
+                if table == 'irs' and scope != 'US':
+                    continue
+
+                if table == 'oecd' and scope == 'US':
+                    continue
+
+                yield table, year, scope
+
+
+########################################################################################################################
+# --- Table registry
+
+class TableRegistry:
+    """
+    Loads every output table once and keeps, for each (table, year, scope) combination, both the DataFrame and the
+    JSON payload that the routes send back, so that requests only amount to a dictionary lookup.
+    """
+
+    def __init__(self, path_to_outputs=path_to_outputs, use_columnar=True, compress_payloads=True, categorical=False):
+        self.path_to_outputs = path_to_outputs
+        self.use_columnar = use_columnar
+        self.compress_payloads = compress_payloads
+        self.categorical = categorical
+
+        self.compression_cache = CompressedPayloadCache(os.path.join(path_to_outputs, 'compressed'))
+
+        self.tables = {}
+        self.payloads = {}
+        self.compressed_payloads = {}
+        self.array_offsets = {}
+        self.indexes = {}
+        self.rankings = {}
+        self.aggregators = {}
+        self.tensors = {}
+        self.panels = {}
+        self.versions = {}
+
+        self.diff_pairs = set()
+        self.diff_payloads = {}
+
+        self.countries = None
+
+        self.data_version = None
+        self.load_time = None
+
+    def read_table(self, table, year, scope):
+        file_name = get_file_name(table, year, scope)
+        path_to_table = get_columnar_dir(file_name, os.path.join(self.path_to_outputs, 'columnar'))
+
+        # The memory-mapped columnar copy is preferred and the CSV export is only parsed as a fallback
+        if self.use_columnar and os.path.exists(path_to_table):
+            return read_columnar(path_to_table, categorical=self.categorical)
+
+        return pd.read_csv(os.path.join(self.path_to_outputs, file_name))
+
+    def read_version(self, table, year, scope):
+        # Content hash and modification time of the CSV export, used for the HTTP validators of the routes
+        path_to_file = os.path.join(self.path_to_outputs, get_file_name(table, year, scope))
+
+        with open(path_to_file, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+
+        last_modified = datetime.datetime.fromtimestamp(int(os.path.getmtime(path_to_file)), tz=datetime.timezone.utc)
+
+        return {'hash': content_hash, 'last_modified': last_modified}
+
+    def load(self):
+        start = time.perf_counter()
+
+        # Read first, so that a version published while the tables are loading triggers another reload
+        self.data_version = read_manifest(self.path_to_outputs).get('version')
+
+        for key in iter_table_keys():
+            table = self.read_table(*key)
+            validate_table(table, key[0], key[1])
+
+            self.tables[key] = table
+            self.versions[key] = self.read_version(*key)
+
+        # Country codes are dictionary-encoded with the same dictionary in all the tables
+        self.countries = CountryDictionary.from_tables(self.tables.values())
+
+        for key, table in self.tables.items():
+
+            if self.categorical:
+                table = apply_schema(table, key[0], key[1], self.countries)
+                self.tables[key] = table
+
+            for orient, precision in PRECOMPUTED_VARIANTS:
+
+                if orient == 'arrays':
+                    payload, self.array_offsets[(*key, precision)] = encode_arrays(table, precision)
+
+                else:
+                    payload = to_json(table, orient, precision).encode('utf-8')
+
+                self.payloads[(*key, orient, precision)] = payload
+
+                if not self.compress_payloads:
+                    continue
+
+                # Variants missing from the on-disk cache are compressed on their first request rather than here, so
+                # that a process started before the build warmed the cache does not spend its startup compressing
+                for encoding in ENCODINGS:
+                    compressed_payload = self.compression_cache.read(payload, encoding)
+
+                    if compressed_payload is not None:
+                        self.compressed_payloads[(*key, orient, precision, encoding)] = compressed_payload
+
+            if key[0] in INDEXED_TABLE_NAMES:
+                self.indexes[key] = KeyIndex(table)
+
+            self.rankings[key] = RankingIndex(table)
+
+        # The continents are taken from the irs and oecd tables, hence once all the tables are loaded
+        continents = build_continent_mapping(
+            [table for key, table in self.tables.items() if key[0] in ['irs', 'oecd']]
+        )
+
+        for key, table in self.tables.items():
+            if key[0] == 'sales_mapping':
+                self.aggregators[key] = SalesMappingAggregator(table, continents)
+                self.tensors[key] = SalesTensor(table, self.countries)
+
+        # Panels share the key encoding of the tensors, so that aligning the years only takes a merge of sorted keys
+        for scope, available_years in AVAILABLE_YEARS.items():
+            self.panels[scope] = SalesPanel(
+                {year: self.tensors[('sales_mapping', year, scope)] for year in available_years}, self.countries
+            )
+
+        self.diff_pairs = set(iter_fixed_pairs(self.tables))
+
+        self.load_time = time.perf_counter() - start
+
+        return self
+
+    def check_key(self, table, year, scope):
+        if (table, year, scope) not in self.tables:
+            raise KeyError(f'No output table is available for table={table}, year={year} and scope={scope}.')
+
+    def get_table(self, table, year, scope):
+        self.check_key(table, year, scope)
+
+        return self.tables[(table, year, scope)]
+
+    def get_version(self, table, year, scope):
+        self.check_key(table, year, scope)
+
+        return self.versions[(table, year, scope)]
+
+    def get_payload(self, table, year, scope, orient='columns', precision=DEFAULT_PRECISION):
+        self.check_key(table, year, scope)
+
+        payload = self.payloads.get((table, year, scope, orient, precision))
+        record_lookup('payloads', payload is not None)
+
+        if payload is None:
+            payload = to_json(self.tables[(table, year, scope)], orient, precision).encode('utf-8')
+
+        return payload
+
+    def get_column_array(self, table, year, scope, column, precision=DEFAULT_PRECISION):
+        # JSON array of the values of a column, read from the precomputed 'arrays' payload without any copy if possible
+        self.check_key(table, year, scope)
+
+        offsets = self.array_offsets.get((table, year, scope, precision))
+
+        if offsets is None:
+            return self.tables[(table, year, scope)][column].to_json(
+                orient='values', double_precision=precision
+            ).encode('utf-8')
+
+        start, stop = offsets[column]
+
+        return memoryview(self.payloads[(table, year, scope, 'arrays', precision)])[start:stop]
+
+    def get_compressed_payload(self, table, year, scope, orient, precision, encoding):
+        # Only the precomputed variants are available compressed; None means that the payload is sent as is
+        key = (table, year, scope, orient, precision)
+        compressed_payload = self.compressed_payloads.get((*key, encoding))
+        record_lookup('compressed_payloads', compressed_payload is not None)
+
+        if compressed_payload is None and self.compress_payloads and key in self.payloads:
+            compressed_payload = self.compression_cache.get_or_compress(self.payloads[key], encoding)
+            self.compressed_payloads[(*key, encoding)] = compressed_payload
+
+        return compressed_payload
+
+    def compress_all(self, levels=None):
+        # Compresses the precomputed payloads that are missing from the on-disk cache, with the given level for each
+        # encoding, and removes the files of the payloads that are not served anymore
+        for key, payload in self.payloads.items():
+            for encoding in ENCODINGS:
+                self.compressed_payloads[(*key, encoding)] = self.compression_cache.get_or_compress(
+                    payload, encoding, None if levels is None else levels[encoding]
+                )
+
+        return self.compression_cache.prune(self.payloads.values())
+
+    def aggregate(self, table, year, scope, group_by, metrics, filters):
+        self.check_key(table, year, scope)
+
+        if (table, year, scope) not in self.aggregators:
+            raise KeyError(f'The {table} table cannot be aggregated.')
+
+        positions = self.select_positions(table, year, scope, filters) if filters else None
+
+        return self.aggregators[(table, year, scope)].aggregate(group_by, metrics, positions)
+
+    def get_tensor(self, table, year, scope):
+        self.check_key(table, year, scope)
+
+        if (table, year, scope) not in self.tensors:
+            raise KeyError(f'No sparse representation of the {table} table is available.')
+
+        return self.tensors[(table, year, scope)]
+
+    def get_memory_usage(self):
+        # Bytes held by each table and by the structures derived from it; the categories of the country columns are
+        # counted in each table, although the tables share them
+        usage = []
+
+        for key, table in self.tables.items():
+            usage.append({
+                'table': key[0],
+                'year': key[1],
+                'scope': key[2],
+                'rows': len(table),
+                'dtypes': {column: str(dtype) for column, dtype in table.dtypes.items()},
+                'memory': int(table.memory_usage(deep=True).sum()),
+                'payloads': sum(
+                    len(self.payloads[(*key, orient, precision)]) for orient, precision in PRECOMPUTED_VARIANTS
+                ),
+                'compressed_payloads': sum(
+                    len(self.compressed_payloads.get((*key, orient, precision, encoding), b''))
+                    for orient, precision in PRECOMPUTED_VARIANTS for encoding in ENCODINGS
+                ),
+            })
+
+        return usage
+
+    def get_panel(self, scope):
+        if scope not in self.panels:
+            raise KeyError(f'No panel is available for scope={scope}.')
+
+        return self.panels[scope]
+
+    def diff(self, left, right):
+        # left and right are (table, year, scope) keys of the same table
+        self.check_key(*left)
+        self.check_key(*right)
+
+        return diff_tables(self.tables[left], self.tables[right], left[0], self.countries)
+
+    def get_diff_payload(self, left, right, orient='columns', precision=DEFAULT_PRECISION):
+        # The payloads of the comparisons between output files are kept once computed, as the tables never change
+        payload = self.diff_payloads.get((left, right, orient, precision))
+        record_lookup('diff_payloads', payload is not None)
+
+        if payload is None:
+            payload = to_json(self.diff(left, right), orient, precision).encode('utf-8')
+
+            if (left, right) in self.diff_pairs and precision == DEFAULT_PRECISION:
+                self.diff_payloads[(left, right, orient, precision)] = payload
+
+        return payload
+
+    def rank_positions(self, table, year, scope, sort_by, order, top=None, filters=None):
+        # Positions of the (top) rows sorted on a numeric column, among those selected by the filters if any
+        self.check_key(table, year, scope)
+
+        ranking = self.rankings[(table, year, scope)]
+
+        if not filters:
+            return ranking.top(sort_by, order, top)
+
+        # Rows are ranked within each parent country at load time; other filters go through the key index
+        if list(filters) == [GROUP_COLUMN] and ranking.group_codes is not None:
+            return ranking.top(sort_by, order, top, filters[GROUP_COLUMN])
+
+        return ranking.sort(sort_by, order, self.select_positions(table, year, scope, filters))[:top]
+
+    def select_positions(self, table, year, scope, filters):
+        self.check_key(table, year, scope)
+
+        parent_column = KEY_COLUMNS['parent']
+        df = self.tables[(table, year, scope)]
+
+        # The sales mappings of US multinationals have no parent column, their parent being implicitly the United States
+        if scope == 'US' and filters and parent_column in filters and parent_column not in df.columns:
+            if DEFAULT_PARENT not in filters[parent_column]:
+                return np.empty(0, dtype=np.int64)
+
+            filters = {column: codes for column, codes in filters.items() if column != parent_column}
+
+        if not filters:
+            return np.arange(len(df))
+
+        if (table, year, scope) not in self.indexes:
+            raise KeyError(f'The {table} table cannot be filtered on country codes.')
+
+        return self.indexes[(table, year, scope)].select(filters)
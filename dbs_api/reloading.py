@@ -0,0 +1,99 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import time
+import logging
+import threading
+
+from dbs_api.outputs import MANIFEST_FILE_NAME, read_manifest, path_to_outputs
+
+########################################################################################################################
+# --- Utils
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two checks of the manifest, which only cost a stat of the file otherwise
+RELOAD_CHECK_INTERVAL = 10
+
+
+########################################################################################################################
+# --- Hot reload of the registry
+
+class RegistryReloader:
+    """
+    Holds the registry that serves the requests and replaces it when outputs.py publishes a new version of the output
+    files in the manifest. The new registry is fully loaded, payloads included, in a background thread while the
+    current one keeps serving; the swap is a single reference assignment, and the requests that started on the
+    previous registry keep using it until they complete.
+    """
+
+    def __init__(self, load_registry, path_to_outputs=path_to_outputs, check_interval=RELOAD_CHECK_INTERVAL):
+        self.load_registry = load_registry
+        self.path_to_outputs = path_to_outputs
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.manifest_mtime = self.get_manifest_mtime()
+        self.last_check = time.monotonic()
+
+        self.registry = load_registry()
+
+    def get_manifest_mtime(self):
+        try:
+            return os.stat(os.path.join(self.path_to_outputs, MANIFEST_FILE_NAME)).st_mtime_ns
+
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        now = time.monotonic()
+
+        if now - self.last_check >= self.check_interval:
+            self.last_check = now
+            self.check()
+
+        return self.registry
+
+    def check(self):
+        # Returns True if a new version was found and is being loaded
+        manifest_mtime = self.get_manifest_mtime()
+
+        if manifest_mtime == self.manifest_mtime:
+            return False
+
+        with self.lock:
+
+            # A version published while another one is loading is picked up at the next check
+            if self.thread is not None and self.thread.is_alive():
+                return False
+
+            self.manifest_mtime = manifest_mtime
+
+            # The manifest is also rewritten during the build, but the version only changes once it is complete
+            version = read_manifest(self.path_to_outputs).get('version')
+
+            if version is None or version == self.registry.data_version:
+                return False
+
+            self.thread = threading.Thread(target=self.reload, args=(version, ), daemon=True)
+            self.thread.start()
+
+        return True
+
+    def reload(self, version):
+        start = time.perf_counter()
+
+        try:
+            registry = self.load_registry()
+
+        except Exception:
+            # The current registry keeps serving, until the manifest changes again
+            logger.exception('Failed to load version %s of the outputs', version)
+            return
+
+        self.registry = registry
+
+        logger.info('Version %s of the outputs loaded in %.1fs', registry.data_version, time.perf_counter() - start)
@@ -0,0 +1,155 @@
+########################################################################################################################
+# --- Imports
+
+import pandas as pd
+
+########################################################################################################################
+# --- Utils
+
+# Kinds of columns: ISO3 codes, stored as categoricals over the country dictionary shared by all the tables; other
+# strings, stored as categoricals over their own values; floats, kept in float64 so that the payloads do not change;
+# integers, downcast to the smallest type that holds their values; numbers, which are floats or integers depending on
+# the scope
+COUNTRY = 'country'
+CATEGORY = 'category'
+FLOAT = 'float'
+INTEGER = 'integer'
+NUMBER = 'number'
+
+# Columns of each family of output tables, with their kind and whether all the tables of the family have them; the
+# '{year}' placeholder stands for the year of the table
+SCHEMAS = {
+    'sales_mapping': {
+        'PARENT_COUNTRY_CODE': (COUNTRY, False),
+        'AFFILIATE_COUNTRY_CODE': (COUNTRY, True),
+        'OTHER_COUNTRY_CODE': (COUNTRY, True),
+        'AFFILIATE_COUNTRY_NAME': (CATEGORY, False),
+        'UNRELATED_PARTY_REVENUES': (FLOAT, True),
+        'RELATED_PARTY_REVENUES': (FLOAT, True),
+        'TOTAL_REVENUES': (FLOAT, True),
+    },
+    'intermediary_dataframe_1': {
+        'AFFILIATE_COUNTRY_CODE': (COUNTRY, False),
+        'AFFILIATE_COUNTRY_NAME': (CATEGORY, True),
+        'UNRELATED_PARTY_REVENUES': (NUMBER, True),
+        'RELATED_PARTY_REVENUES': (NUMBER, True),
+        'TOTAL_REVENUES': (NUMBER, True),
+        'CODE': (COUNTRY, False),
+        'CONTINENT_NAME': (CATEGORY, False),
+        'CONTINENT_CODE': (CATEGORY, False),
+        'COUNTRY_CODE': (COUNTRY, True),
+        'CONS_{year}': (FLOAT, False),
+        'CONS_{year}_x': (FLOAT, False),
+        'CONS_{year}_y': (FLOAT, False),
+        'SHARE_OF_UNRELATED_PARTY_REVENUES': (FLOAT, True),
+        'SHARE_OF_RELATED_PARTY_REVENUES': (FLOAT, True),
+        'SHARE_OF_TOTAL_REVENUES': (FLOAT, True),
+        'SHARE_OF_CONS_{year}': (FLOAT, True),
+    },
+    'intermediary_dataframe_2': {
+        'UNRELATED_PARTY_REVENUES': (FLOAT, True),
+        'RELATED_PARTY_REVENUES': (FLOAT, True),
+        'TOTAL_REVENUES': (FLOAT, True),
+        'COUNTRY_CODE': (COUNTRY, True),
+        'COUNTRY_NAME': (CATEGORY, True),
+        'CONS_{year}': (FLOAT, False),
+        'CONS_{year}_x': (FLOAT, False),
+        'CONS_{year}_y': (FLOAT, False),
+        'SHARE_OF_UNRELATED_PARTY_REVENUES': (FLOAT, True),
+        'SHARE_OF_RELATED_PARTY_REVENUES': (FLOAT, True),
+        'SHARE_OF_TOTAL_REVENUES': (FLOAT, True),
+        'SHARE_OF_CONS_{year}': (FLOAT, True),
+    },
+    'irs': {
+        'AFFILIATE_COUNTRY_NAME': (CATEGORY, True),
+        'UNRELATED_PARTY_REVENUES': (INTEGER, True),
+        'RELATED_PARTY_REVENUES': (INTEGER, True),
+        'TOTAL_REVENUES': (INTEGER, True),
+        'CODE': (COUNTRY, True),
+        'CONTINENT_NAME': (CATEGORY, True),
+        'CONTINENT_CODE': (CATEGORY, True),
+    },
+    'oecd': {
+        'PARENT_COUNTRY_CODE': (COUNTRY, True),
+        'PARENT_COUNTRY_NAME': (CATEGORY, True),
+        'AFFILIATE_COUNTRY_CODE': (COUNTRY, True),
+        'AFFILIATE_COUNTRY_NAME': (CATEGORY, True),
+        'RELATED_PARTY_REVENUES': (FLOAT, True),
+        'TOTAL_REVENUES': (FLOAT, True),
+        'UNRELATED_PARTY_REVENUES': (FLOAT, True),
+        'NB_AFFILIATE_COUNTRIES': (INTEGER, True),
+        'CONTINENT_CODE': (CATEGORY, True),
+    },
+}
+
+COUNTRY_COLUMNS = sorted({
+    column for schema in SCHEMAS.values() for column, (kind, _) in schema.items() if kind == COUNTRY
+})
+
+
+def get_schema(table, year):
+    return {column.format(year=year): specification for column, specification in SCHEMAS[table].items()}
+
+
+def check_kind(series, kind):
+    if kind == FLOAT:
+        return pd.api.types.is_float_dtype(series)
+
+    if kind == INTEGER:
+        return pd.api.types.is_integer_dtype(series)
+
+    if kind == NUMBER:
+        return pd.api.types.is_numeric_dtype(series)
+
+    # Strings are either objects or categoricals of objects
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.categories.dtype == object
+
+    return series.dtype == object
+
+
+########################################################################################################################
+# --- Validation and compact dtypes
+
+def validate_table(df, table, year):
+    schema = get_schema(table, year)
+
+    unknown_columns = [column for column in df.columns if column not in schema]
+    missing_columns = [column for column, (_, required) in schema.items() if required and column not in df.columns]
+    wrong_columns = [
+        column for column in df.columns if column in schema and not check_kind(df[column], schema[column][0])
+    ]
+
+    if unknown_columns or missing_columns or wrong_columns:
+        raise ValueError(
+            f'The {table} table of {year} does not match its schema. Unknown columns: {unknown_columns}, missing '
+            + f'columns: {missing_columns}, columns of the wrong type: {wrong_columns}.'
+        )
+
+
+def apply_schema(df, table, year, countries):
+    # Returns a copy of the table with compact dtypes; the numeric columns are views on the original ones when they
+    # are not downcast
+    schema = get_schema(table, year)
+
+    columns = {}
+
+    for column in df.columns:
+        kind = schema[column][0]
+
+        if kind == COUNTRY:
+            columns[column] = df[column].astype(countries.dtype)
+
+            if columns[column].isnull().sum() > df[column].isnull().sum():
+                raise ValueError(f'The {column} column of the {table} table of {year} has unknown country codes.')
+
+        elif kind == CATEGORY:
+            columns[column] = df[column].astype('category')
+
+        elif pd.api.types.is_integer_dtype(df[column]):
+            columns[column] = pd.to_numeric(df[column], downcast='integer')
+
+        else:
+            columns[column] = df[column]
+
+    return pd.DataFrame(columns, columns=df.columns, copy=False)
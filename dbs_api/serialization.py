@@ -0,0 +1,113 @@
+########################################################################################################################
+# --- Imports
+
+import json
+import base64
+
+########################################################################################################################
+# --- Utils
+
+OUTPUT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Number of rows serialized at once when streaming a table
+STREAM_CHUNK_SIZE = 2000
+
+# JSON layouts: 'columns' is the pandas default that the API has always returned, 'arrays' maps each column name to
+# the list of its values and, like 'split' and 'records', drops the row index
+ORIENTS = ['columns', 'records', 'split', 'arrays']
+
+# Number of decimals of the floats in JSON payloads (pandas' default)
+DEFAULT_PRECISION = 10
+MAX_PRECISION = 15
+
+
+########################################################################################################################
+# --- JSON serialization
+
+def encode_arrays(df, precision=DEFAULT_PRECISION):
+    # Returns the 'arrays' payload along with the position of each column's JSON array in it, so that the arrays can
+    # later be reused as they are, for instance in batch payloads
+    parts = [b'{']
+    offsets = {}
+    position = 1
+
+    for i, column in enumerate(df.columns):
+        prefix = ((',' if i else '') + json.dumps(column) + ':').encode('utf-8')
+        fragment = df[column].to_json(orient='values', double_precision=precision).encode('utf-8')
+
+        position += len(prefix)
+        offsets[column] = (position, position + len(fragment))
+        position += len(fragment)
+
+        parts.extend([prefix, fragment])
+
+    parts.append(b'}')
+
+    return b''.join(parts), offsets
+
+
+def to_json(df, orient='columns', precision=DEFAULT_PRECISION):
+    if orient == 'arrays':
+        return encode_arrays(df, precision)[0].decode('utf-8')
+
+    if orient == 'split':
+        return df.to_json(orient='split', index=False, double_precision=precision)
+
+    return df.to_json(orient=orient, double_precision=precision)
+
+
+########################################################################################################################
+# --- Pagination cursors
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(f'offset:{offset}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        prefix, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        offset = int(offset)
+
+    except ValueError:
+        raise Exception(f'The cursor {cursor} is not valid. Please use the one returned in the X-Next-Cursor header.')
+
+    if prefix != 'offset' or offset < 0:
+        raise Exception(f'The cursor {cursor} is not valid. Please use the one returned in the X-Next-Cursor header.')
+
+    return offset
+
+
+########################################################################################################################
+# --- Streaming serializers
+
+def iter_chunks(table, positions, chunk_size=STREAM_CHUNK_SIZE):
+    # Only one chunk of rows is materialized at a time, whatever the size of the selection
+    for start in range(0, len(positions), chunk_size):
+        yield table.iloc[positions[start:start + chunk_size]]
+
+
+def iter_ndjson(table, positions, precision=DEFAULT_PRECISION, chunk_size=STREAM_CHUNK_SIZE):
+    for chunk in iter_chunks(table, positions, chunk_size):
+        lines = chunk.to_json(orient='records', lines=True, double_precision=precision)
+
+        yield (lines.rstrip('\n') + '\n').encode('utf-8')
+
+
+def iter_csv(table, positions, precision=None, chunk_size=STREAM_CHUNK_SIZE):
+    # Without an explicit precision, floats are written in full as in the CSV exports
+    float_format = None if precision is None else f'%.{precision}f'
+
+    yield table.iloc[:0].to_csv(index=False).encode('utf-8')
+
+    for chunk in iter_chunks(table, positions, chunk_size):
+        yield chunk.to_csv(index=False, header=False, float_format=float_format).encode('utf-8')
+
+
+STREAMING_SERIALIZERS = {
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
@@ -0,0 +1,184 @@
+########################################################################################################################
+# --- Imports
+
+import numpy as np
+import pandas as pd
+
+from dbs_api.aggregation import METRICS
+from dbs_api.indexes import KEY_COLUMNS
+from dbs_api.schemas import COUNTRY_COLUMNS
+
+########################################################################################################################
+# --- Utils
+
+DIMENSIONS = list(KEY_COLUMNS)
+
+# The sales mappings of US multinationals have no parent column: all their rows are attributed to the United States
+DEFAULT_PARENT = 'USA'
+
+
+########################################################################################################################
+# --- Dictionary of country codes
+
+class CountryDictionary:
+    """
+    Dictionary-encodes the ISO3 country codes of all the output tables into integer IDs, in alphabetical order.
+    """
+
+    def __init__(self, codes):
+        self.codes = np.array(sorted(set(codes)), dtype=object)
+        self.categories = pd.Index(self.codes)
+
+        # Country columns of the tables loaded with compact dtypes are categoricals of this type
+        self.dtype = pd.CategoricalDtype(self.categories)
+
+    @classmethod
+    def from_tables(cls, tables):
+        codes = set()
+
+        for df in tables:
+            for column in COUNTRY_COLUMNS:
+                if column in df.columns:
+                    codes.update(df[column].astype(str).unique())
+
+        return cls(codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def encode(self, values):
+        # Codes that are not in the dictionary are encoded as -1; the codes of the shared categoricals are the IDs
+        if isinstance(values, pd.Series) and values.dtype == self.dtype:
+            return values.cat.codes.to_numpy(dtype=np.intp)
+
+        return self.categories.get_indexer(values)
+
+    def decode(self, ids):
+        return self.codes[ids]
+
+
+########################################################################################################################
+# --- Sparse representation of a sales mapping
+
+class SparseCountryArray:
+    """
+    Base class of the sparse arrays indexed by (parent, affiliate, other country) coordinates. The coordinates are
+    combined into a single integer key, by which the entries are sorted; the entries of each parent country thus form
+    a contiguous range (as in a CSR matrix), located through the parent_indptr array.
+    """
+
+    def __init__(self, countries):
+        self.countries = countries
+        self.n = len(countries)
+
+        # The keys fit in 32 bits as long as there are fewer than 1290 countries
+        self.key_dtype = np.int32 if self.n ** 3 < np.iinfo(np.int32).max else np.int64
+
+        self.keys = None
+        self.parent_indptr = None
+
+    def encode_keys(self, sales_mapping):
+        ids = {}
+
+        for dimension, column in KEY_COLUMNS.items():
+            if column in sales_mapping.columns:
+                ids[dimension] = self.countries.encode(sales_mapping[column]).astype(self.key_dtype)
+
+            else:
+                ids[dimension] = np.full(
+                    len(sales_mapping), self.countries.encode([DEFAULT_PARENT])[0], dtype=self.key_dtype
+                )
+
+        return (ids['parent'] * self.n + ids['affiliate']) * self.n + ids['other']
+
+    def set_keys(self, keys):
+        # keys must be sorted
+        self.keys = keys
+        self.parent_indptr = np.searchsorted(keys, np.arange(self.n + 1, dtype=np.int64) * self.n * self.n)
+
+    def get_ids(self, dimension, positions):
+        keys = self.keys[positions]
+
+        if dimension == 'parent':
+            return keys // (self.n * self.n)
+
+        if dimension == 'affiliate':
+            return (keys // self.n) % self.n
+
+        return keys % self.n
+
+    def decode_keys(self, positions):
+        return {
+            KEY_COLUMNS[dimension]: self.countries.decode(self.get_ids(dimension, positions))
+            for dimension in DIMENSIONS
+        }
+
+    def select(self, filters):
+        # filters maps dimensions to lists of country codes; returns positions in the sorted arrays
+        filters = {dimension: self.countries.encode(codes) for dimension, codes in filters.items()}
+
+        if 'parent' in filters:
+            parent_ids = np.unique(filters.pop('parent'))
+            parent_ids = parent_ids[parent_ids >= 0]
+
+            positions = np.concatenate(
+                [np.arange(self.parent_indptr[i], self.parent_indptr[i + 1]) for i in parent_ids] + [np.empty(0, int)]
+            )
+
+        else:
+            positions = np.arange(len(self.keys))
+
+        for dimension, ids in filters.items():
+            positions = positions[np.isin(self.get_ids(dimension, positions), ids)]
+
+        return positions
+
+
+class SalesTensor(SparseCountryArray):
+    """
+    Stores a sales mapping as a sparse parent x affiliate x other country array of the three revenue measures, in COO
+    format with sorted keys.
+    """
+
+    def __init__(self, sales_mapping, countries):
+        super().__init__(countries)
+
+        keys = self.encode_keys(sales_mapping)
+        order = np.argsort(keys, kind='stable')
+
+        self.set_keys(keys[order])
+        self.values = np.ascontiguousarray(sales_mapping[METRICS].to_numpy(dtype=np.float64)[order])
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes + self.parent_indptr.nbytes
+
+    def slice(self, filters):
+        positions = self.select(filters)
+
+        return pd.DataFrame(self.decode_keys(positions)).join(pd.DataFrame(self.values[positions], columns=METRICS))
+
+    def matrix(self, rows, columns, metric, filters):
+        # Bilateral matrix of one measure, summed over the third dimension, on the countries that have observations
+        positions = self.select(filters)
+
+        row_ids = self.get_ids(rows, positions)
+        column_ids = self.get_ids(columns, positions)
+
+        # The sums are computed on the full country x country grid, which is then restricted to the observed countries
+        matrix = np.bincount(
+            row_ids * self.n + column_ids,
+            weights=self.values[positions, METRICS.index(metric)],
+            minlength=self.n * self.n
+        ).reshape(self.n, self.n)
+
+        row_ids = np.flatnonzero(np.bincount(row_ids, minlength=self.n))
+        column_ids = np.flatnonzero(np.bincount(column_ids, minlength=self.n))
+
+        matrix = matrix[np.ix_(row_ids, column_ids)]
+
+        return pd.DataFrame(
+            matrix,
+            index=pd.Index(self.countries.decode(row_ids), name=KEY_COLUMNS[rows]),
+            columns=pd.Index(self.countries.decode(column_ids), name=KEY_COLUMNS[columns])
+        )
@@ -0,0 +1,514 @@
+########################################################################################################################
+# --- Imports
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import datetime
+import threading
+import contextlib
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+path_to_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, path_to_root)
+
+from dbs_api.registry import TableRegistry, AVAILABLE_YEARS, get_file_name, iter_table_keys, path_to_outputs
+from dbs_api.serialization import to_json, ORIENTS
+
+########################################################################################################################
+# --- Utils
+
+ROUTES = [
+    ('/US_sales_mapping?year=2018', ('sales_mapping', 2018, 'US')),
+    ('/global_sales_mapping?year=2017&scope=restricted', ('sales_mapping', 2017, 'global_restricted')),
+    ('/global_sales_mapping?year=2017&scope=unrestricted', ('sales_mapping', 2017, 'global_unrestricted')),
+    ('/US_intermediary_dataframe_1?year=2018', ('intermediary_dataframe_1', 2018, 'US')),
+    ('/global_intermediary_dataframe_2?year=2017', ('intermediary_dataframe_2', 2017, 'global_restricted')),
+]
+
+LARGEST_TABLES = [
+    ('sales_mapping', 2017, 'global_unrestricted'),
+    ('sales_mapping', 2017, 'global_restricted'),
+]
+
+PRECISIONS = [10, 6, 2]
+
+# Requests that reference the strings of the tables, sent to every worker before their memory is measured
+MEMORY_ROUTES = [
+    '/global_sales_mapping?year=2017&scope=unrestricted&format=csv',
+    '/global_sales_mapping?year=2016&scope=restricted&format=ndjson',
+    '/US_sales_mapping?year=2018&affiliate=FRA,DEU',
+    '/global_sales_mapping?year=2017&sort_by=TOTAL_REVENUES&top=100',
+    '/aggregate?scope=global_unrestricted&year=2017&group_by=AFFILIATE_COUNTRY_CODE,OTHER_COUNTRY_CODE',
+    '/US_intermediary_dataframe_1?year=2018&format=csv',
+]
+
+# Gunicorn setups compared by the memory benchmark: whether the app is preloaded in the master process and whether
+# the tables are loaded in the shared-memory mode
+MEMORY_SETUPS = [
+    ('no preload, shared mode off', [], '0'),
+    ('preload, shared mode off', ['--preload'], '0'),
+    ('preload, shared mode on', ['--preload'], '1'),
+]
+
+# Routes over several tables or computed from them, requested in the benchmark suite after the table routes; the
+# custom_sales_mapping routes are left out since they run the whole computation of destination_based_sales
+SUITE_ROUTES = [
+    '/',
+    '/batch?items=sales_mapping:2016:US,sales_mapping:2017:global_restricted&orient=split',
+    '/batch?items=irs:2018:US,oecd:2017:global_unrestricted,intermediary_dataframe_1:2017:global_unrestricted',
+    '/batch?items=sales_mapping:2016:global_unrestricted,sales_mapping:2017:global_unrestricted&layout=stacked',
+    '/aggregate?scope=US&group_by=CONTINENT_CODE',
+    '/aggregate?scope=global_unrestricted&year=2017&group_by=AFFILIATE_COUNTRY_CODE,OTHER_COUNTRY_CODE',
+    '/slice?scope=global_unrestricted&year=2016&parent=JPN&other=FRA,ITA',
+    '/matrix?scope=US&year=2019&rows=parent&columns=affiliate',
+    '/matrix?scope=global_unrestricted&year=2017&rows=affiliate&columns=other',
+    '/timeseries?scope=US&affiliate=FRA&metric=TOTAL_REVENUES',
+    '/timeseries?scope=global_unrestricted&parent=FRA,DEU',
+    '/diff?left=sales_mapping:2016:US&right=sales_mapping:2017:US',
+    '/diff?left=sales_mapping:2016:global_unrestricted&right=sales_mapping:2017:global_unrestricted',
+    '/diagnostics',
+    '/metrics',
+]
+
+# Variants of the largest tables, which are also requested in each output format and layout
+LARGEST_TABLE_VARIANTS = ['&format=csv', '&format=ndjson', '&orient=records', '&orient=arrays&precision=2']
+
+# Metrics compared between two runs of the suite, with the direction in which they regress
+SUITE_METRICS = {
+    'p50_ms': 'higher',
+    'p95_ms': 'higher',
+    'p99_ms': 'higher',
+    'throughput': 'lower',
+    'size_bytes': 'higher',
+}
+
+# Seconds given to gunicorn to load the tables and answer a first request
+GUNICORN_STARTUP_TIMEOUT = 120
+
+path_to_baselines = os.path.join(path_to_root, 'scripts', 'baselines')
+
+
+def time_calls(function, n_repeats):
+    durations = []
+
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return np.median(durations) * 1000
+
+
+def legacy_response(key):
+    # Behaviour of the routes before the table registry: one CSV parsing and one serialization per request
+    return pd.read_csv(os.path.join(path_to_outputs, get_file_name(*key))).to_json()
+
+
+########################################################################################################################
+# --- Comparison of the legacy and registry-based serving paths
+
+def compare_routes(n_repeats):
+    start = time.perf_counter()
+    from dbs_api.app import app
+    startup_time = time.perf_counter() - start
+
+    print(f'Startup (import of the app, {len(list(iter_table_keys()))} tables loaded): {startup_time * 1000:.0f} ms')
+    print(f'Registry loading alone: {TableRegistry().load().load_time * 1000:.0f} ms')
+    print('------------------------------------')
+
+    client = app.test_client()
+
+    for url, key in ROUTES:
+        legacy = time_calls(lambda: legacy_response(key), n_repeats)
+        registry = time_calls(lambda: client.get(url), n_repeats)
+
+        print(f'{url}: legacy {legacy:.2f} ms - registry {registry:.2f} ms (median over {n_repeats} requests)')
+
+
+########################################################################################################################
+# --- Payload size and serialization time of each JSON layout
+
+def compare_serializations(n_repeats):
+    registry = TableRegistry()
+
+    for key in LARGEST_TABLES:
+        df = registry.read_table(*key)
+
+        print(get_file_name(*key), '-', len(df), 'rows')
+
+        for orient in ORIENTS:
+            for precision in PRECISIONS:
+                size = len(to_json(df, orient, precision).encode('utf-8'))
+                duration = time_calls(lambda: to_json(df, orient, precision), n_repeats)
+
+                print(f'    orient={orient:<8} precision={precision:<3} {size / 1e6:6.2f} MB {duration:7.1f} ms')
+
+        print('------------------------------------')
+
+
+########################################################################################################################
+# --- Memory of the gunicorn workers
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+
+        return sock.getsockname()[1]
+
+
+def read_memory(pid):
+    # Resident (RSS), proportional (PSS, shared pages divided among the processes) and unique (USS) sizes, in MB
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        fields = {line.split(':')[0]: int(line.split()[1]) for line in file if line.split()[-1] == 'kB'}
+
+    return {
+        'rss': fields['Rss'] / 1024,
+        'pss': fields['Pss'] / 1024,
+        'uss': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024,
+    }
+
+
+def get_worker_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+
+@contextlib.contextmanager
+def run_gunicorn(options, n_workers, env=None):
+    # Yields the URL and the pid of a local gunicorn master, once it answers requests
+    port = get_free_port()
+
+    process = subprocess.Popen(
+        ['gunicorn', '--workers', str(n_workers), '--bind', f'127.0.0.1:{port}', *options, 'dbs_api.app:app'],
+        cwd=path_to_root, env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    try:
+        url = f'http://127.0.0.1:{port}'
+
+        deadline = time.monotonic() + GUNICORN_STARTUP_TIMEOUT
+
+        while True:
+            try:
+                requests.get(url, timeout=5)
+                break
+
+            except (requests.ConnectionError, requests.Timeout):
+                if process.poll() is not None:
+                    raise Exception(f'gunicorn exited with code {process.returncode} before answering requests.')
+
+                if time.monotonic() > deadline:
+                    raise Exception(f'gunicorn did not answer requests within {GUNICORN_STARTUP_TIMEOUT} seconds.')
+
+                time.sleep(0.5)
+
+        yield url, process.pid
+
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def measure_workers(options, shared_memory, n_workers, n_repeats):
+    with run_gunicorn(options, n_workers, {'DBS_API_SHARED_MEMORY': shared_memory}) as (url, pid):
+
+        # Workers finish loading the tables at different times without --preload
+        time.sleep(5)
+
+        with requests.Session() as session:
+            for _ in range(n_repeats * n_workers):
+                for route in MEMORY_ROUTES:
+                    session.get(url + route).raise_for_status()
+
+        return [read_memory(pid) for pid in get_worker_pids(pid)]
+
+
+def compare_memory(n_workers, n_repeats):
+    for name, options, shared_memory in MEMORY_SETUPS:
+        workers = measure_workers(options, shared_memory, n_workers, n_repeats)
+
+        print(f'{name} - {n_workers} workers')
+
+        for i, worker in enumerate(workers):
+            print(
+                f"    worker {i}: RSS {worker['rss']:6.1f} MB  PSS {worker['pss']:6.1f} MB  USS {worker['uss']:6.1f} MB"
+            )
+
+        print(f"    total PSS {sum(worker['pss'] for worker in workers):.1f} MB")
+        print('------------------------------------')
+
+
+########################################################################################################################
+# --- Benchmark suite of the routes, with JSON baselines
+
+def get_table_url(table, year, scope):
+    if scope == 'US':
+        return f'/US_{table}?year={year}'
+
+    if table == 'sales_mapping':
+        return f"/global_sales_mapping?year={year}&scope={scope.split('_')[1]}"
+
+    # The global intermediary routes only serve the restricted scope, the unrestricted tables are requested via /batch
+    if scope == 'global_restricted':
+        return f'/global_{table}?year={year}'
+
+    return None
+
+
+def iter_suite_cases():
+    # (name, route, headers) of every route, for each year and scope of the table routes
+    for scope, years in AVAILABLE_YEARS.items():
+        for year in years:
+            for table in ['sales_mapping', 'intermediary_dataframe_1', 'intermediary_dataframe_2']:
+                url = get_table_url(table, year, scope)
+
+                if url is None:
+                    continue
+
+                yield url, url, {}
+                yield url + ' (gzip)', url, {'Accept-Encoding': 'gzip'}
+
+                if table == 'sales_mapping':
+                    yield url + '&affiliate=FRA,DEU', url + '&affiliate=FRA,DEU', {}
+                    yield url + '&sort_by=TOTAL_REVENUES&top=100', url + '&sort_by=TOTAL_REVENUES&top=100', {}
+
+    for key in LARGEST_TABLES:
+        for variant in LARGEST_TABLE_VARIANTS:
+            url = get_table_url(*key) + variant
+            yield url, url, {}
+
+    for url in SUITE_ROUTES:
+        yield url, url, {}
+
+
+def summarize(durations, wall_time, size):
+    durations = np.array(durations) * 1000
+
+    return {
+        'requests': len(durations),
+        'p50_ms': float(np.percentile(durations, 50)),
+        'p95_ms': float(np.percentile(durations, 95)),
+        'p99_ms': float(np.percentile(durations, 99)),
+        'throughput': len(durations) / wall_time,
+        'size_bytes': size,
+    }
+
+
+def run_client_case(client, route, headers, n_repeats):
+    # Sequential requests through the Flask test client, without any network or server overhead
+    response = client.get(route, headers=headers)
+    response.close()
+
+    if response.status_code != 200:
+        raise Exception(f'{route} returned a {response.status_code} response.')
+
+    size = len(response.data)
+    durations = []
+
+    start = time.perf_counter()
+
+    for _ in range(n_repeats):
+        request_start = time.perf_counter()
+        response = client.get(route, headers=headers)
+        response.data
+        response.close()
+        durations.append(time.perf_counter() - request_start)
+
+    return summarize(durations, time.perf_counter() - start, size)
+
+
+def run_server_case(url, route, headers, n_repeats, concurrency):
+    # The requests are sent by concurrency threads, each with its own connection; the bodies are read without
+    # decompression, so that the size is the one sent over the network
+    headers = dict({'Accept-Encoding': 'identity'}, **headers)
+    sessions = threading.local()
+
+    def send_request():
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+
+        request_start = time.perf_counter()
+        response = sessions.session.get(url + route, headers=headers, stream=True)
+        body = response.raw.read(decode_content=False)
+
+        if response.status_code != 200:
+            raise Exception(f'{route} returned a {response.status_code} response.')
+
+        return time.perf_counter() - request_start, len(body)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        # Warm-up request in each thread
+        sizes = [size for _, size in executor.map(lambda _: send_request(), range(concurrency))]
+
+        start = time.perf_counter()
+        durations = [duration for duration, _ in executor.map(lambda _: send_request(), range(n_repeats))]
+        wall_time = time.perf_counter() - start
+
+    return summarize(durations, wall_time, sizes[0])
+
+
+def read_peak_rss(pid):
+    # Peak resident size of a process, in MB
+    with open(f'/proc/{pid}/status') as file:
+        fields = {line.split(':')[0]: line.split()[1] for line in file if line.startswith('VmHWM')}
+
+    return int(fields['VmHWM']) / 1024
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path_to_root).decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(target, n_repeats, n_workers, concurrency):
+    results = {
+        'target': target,
+        'commit': get_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'repeats': n_repeats,
+        'cases': {},
+    }
+
+    if target == 'client':
+        from dbs_api.app import app
+
+        client = app.test_client()
+
+        for name, route, headers in iter_suite_cases():
+            results['cases'][name] = run_client_case(client, route, headers, n_repeats)
+            print(f"{name}: p50 {results['cases'][name]['p50_ms']:.2f} ms")
+
+        # Peak resident size of the benchmark process, which includes the app
+        results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    else:
+        results.update(workers=n_workers, concurrency=concurrency)
+
+        with run_gunicorn(['--preload'], n_workers) as (url, pid):
+
+            for name, route, headers in iter_suite_cases():
+                results['cases'][name] = run_server_case(url, route, headers, n_repeats, concurrency)
+                print(f"{name}: p50 {results['cases'][name]['p50_ms']:.2f} ms")
+
+            results['peak_rss_mb'] = max(read_peak_rss(worker_pid) for worker_pid in get_worker_pids(pid))
+
+    return results
+
+
+def save_results(results, file_path):
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+
+    with open(file_path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'Results saved in {file_path}')
+
+
+def get_regressions(baseline, results, threshold):
+    # Relative changes beyond the threshold, in the direction in which each metric regresses
+    regressions = []
+
+    pairs = [
+        (name, metric, case, results['cases'][name])
+        for name, case in baseline['cases'].items() if name in results['cases']
+        for metric in SUITE_METRICS
+    ]
+    pairs.append(('process', 'peak_rss_mb', baseline, results))
+
+    for name, metric, before, after in pairs:
+        if not before.get(metric):
+            continue
+
+        change = after[metric] / before[metric] - 1
+
+        if SUITE_METRICS.get(metric, 'higher') == 'lower':
+            change = -change
+
+        if change > threshold:
+            regressions.append((name, metric, before[metric], after[metric], change))
+
+    return regressions
+
+
+def compare_results(baseline_path, results_path, threshold):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    with open(results_path) as file:
+        results = json.load(file)
+
+    if baseline['target'] != results['target']:
+        raise Exception(f"Cannot compare a {baseline['target']} baseline with {results['target']} results.")
+
+    missing_cases = sorted(set(baseline['cases']) - set(results['cases']))
+
+    if missing_cases:
+        print(f"Cases of the baseline missing from the results: {', '.join(missing_cases)}")
+
+    regressions = get_regressions(baseline, results, threshold)
+
+    for name, metric, before, after, change in regressions:
+        print(f'{name}: {metric} {before:.2f} -> {after:.2f} ({change:+.0%} worse)')
+
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%} over {len(results['cases'])} cases, "
+          + f"baseline {baseline['commit']} - results {results['commit']}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'benchmark', choices=['routes', 'serialization', 'memory', 'suite', 'compare'], nargs='?', default='routes'
+    )
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4, help='number of gunicorn workers (memory and suite)')
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client', help='server of the suite')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent requests against gunicorn (suite)')
+    parser.add_argument('--output', help='file in which the suite saves its results')
+    parser.add_argument('--baseline', help='results of the suite to compare with')
+    parser.add_argument('--results', help='results of the suite compared with the baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change flagged as a regression')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'routes':
+        compare_routes(args.repeats)
+
+    elif args.benchmark == 'serialization':
+        compare_serializations(args.repeats)
+
+    elif args.benchmark == 'memory':
+        compare_memory(args.workers, args.repeats)
+
+    elif args.benchmark == 'suite':
+        results = run_suite(args.target, args.repeats, args.workers, args.concurrency)
+        save_results(results, args.output or os.path.join(path_to_baselines, f'{args.target}.json'))
+
+    else:
+        if args.results is None:
+            parser.error('the compare benchmark needs the --results of a run of the suite')
+
+        baseline_path = args.baseline or os.path.join(path_to_baselines, f'{args.target}.json')
+
+        if not os.path.exists(baseline_path):
+            parser.error(f'no baseline in {baseline_path}, run the suite first or pass --baseline')
+
+        if compare_results(baseline_path, args.results, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,469 @@
+import io
+import os
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dbs_api.app import app, registry
+from dbs_api.compression import CompressedPayloadCache, ENCODINGS, FILE_EXTENSIONS, brotli
+from dbs_api.registry import TableRegistry, iter_table_keys, get_file_name, path_to_outputs
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_registry_holds_every_output_file():
+    keys = list(iter_table_keys())
+
+    assert len(keys) == 32
+    assert sorted(get_file_name(*key) for key in keys) == sorted(
+        file_name for file_name in os.listdir(path_to_outputs) if file_name.endswith('.csv')
+    )
+
+    for key in keys:
+        assert key in registry.tables
+        assert (*key, 'columns', 10) in registry.payloads
+
+
+def test_routes_serve_the_same_payload_as_the_csv_files(client):
+    for url, file_name in [
+        ('/US_sales_mapping?year=2016', 'sales_mapping_US_2016.csv'),
+        ('/global_sales_mapping?year=2017&scope=unrestricted', 'sales_mapping_global_unrestricted_2017.csv'),
+        ('/US_intermediary_dataframe_1?year=2019', 'intermediary_dataframe_1_US_2019.csv'),
+        ('/US_intermediary_dataframe_2?year=2017', 'intermediary_dataframe_2_US_2017.csv'),
+        ('/global_intermediary_dataframe_1?year=2016', 'intermediary_dataframe_1_global_restricted_2016.csv'),
+        ('/global_intermediary_dataframe_2?year=2017', 'intermediary_dataframe_2_global_restricted_2017.csv'),
+    ]:
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/json'
+        assert json.loads(response.data) == json.loads(
+            pd.read_csv(os.path.join(path_to_outputs, file_name), float_precision='round_trip').to_json()
+        )
+
+
+def test_invalid_year_is_rejected(client):
+    assert client.get('/global_sales_mapping?year=2019').status_code == 500
+
+    with pytest.raises(KeyError):
+        registry.get_payload('irs', 2017, 'global_restricted')
+
+
+def test_sales_mapping_filters(client):
+    sales_mapping = registry.get_table('sales_mapping', 2017, 'global_unrestricted')
+
+    response = client.get('/global_sales_mapping?year=2017&scope=unrestricted&parent=FRA,DEU&other=USA&other=CHN')
+    filtered = pd.read_json(io.StringIO(response.data.decode()))
+
+    expected = sales_mapping[
+        sales_mapping['PARENT_COUNTRY_CODE'].isin(['FRA', 'DEU'])
+        & sales_mapping['OTHER_COUNTRY_CODE'].isin(['USA', 'CHN'])
+    ]
+
+    assert len(filtered) > 0
+    assert list(filtered.index) == list(expected.index)
+    assert response.data.decode() == expected.to_json()
+
+    response = client.get('/US_sales_mapping?year=2018&affiliate=fra')
+    filtered = pd.read_json(io.StringIO(response.data.decode()))
+
+    assert set(filtered['AFFILIATE_COUNTRY_CODE']) == {'FRA'}
+
+    assert json.loads(client.get('/US_sales_mapping?year=2018&affiliate=XXX').data)['TOTAL_REVENUES'] == {}
+
+    # The parent of US multinationals is implicitly the United States
+    response = client.get('/US_sales_mapping?year=2018&parent=USA&affiliate=FRA')
+    assert response.data == client.get('/US_sales_mapping?year=2018&affiliate=FRA').data
+
+    assert json.loads(client.get('/US_sales_mapping?year=2018&parent=FRA').data)['TOTAL_REVENUES'] == {}
+    assert len(json.loads(client.get('/US_sales_mapping?year=2018&parent=FRA,USA&orient=records').data)) == len(
+        registry.get_table('sales_mapping', 2018, 'US')
+    )
+
+    # The other tables cannot be filtered on country codes
+    assert client.get('/global_intermediary_dataframe_1?year=2017&parent=FRA').status_code == 500
+    assert client.get('/US_intermediary_dataframe_2?year=2017&affiliate=FRA').status_code == 500
+
+
+def test_cursor_pagination(client):
+    sales_mapping = registry.get_table('sales_mapping', 2016, 'global_restricted')
+
+    pages = []
+    url = '/global_sales_mapping?year=2016&limit=10000&format=ndjson'
+
+    while True:
+        response = client.get(url)
+        pages.append(pd.read_json(io.StringIO(response.data.decode()), lines=True))
+
+        assert response.headers['X-Total-Count'] == str(len(sales_mapping))
+
+        if 'X-Next-Cursor' not in response.headers:
+            break
+
+        url = '/global_sales_mapping?year=2016&limit=10000&format=ndjson&cursor=' + response.headers['X-Next-Cursor']
+
+    assert len(pages) == 3
+    assert pd.concat(pages)['TOTAL_REVENUES'].sum() == pytest.approx(sales_mapping['TOTAL_REVENUES'].sum())
+
+    response = client.get('/US_intermediary_dataframe_2?year=2017&limit=5')
+
+    assert json.loads(response.data) == json.loads(
+        registry.get_table('intermediary_dataframe_2', 2017, 'US').head(5).to_json()
+    )
+
+    assert client.get('/US_sales_mapping?limit=0').status_code == 500
+    assert client.get('/US_sales_mapping?cursor=abc').status_code == 500
+
+
+def test_csv_streaming(client):
+    response = client.get('/US_sales_mapping?year=2019&format=csv&affiliate=DEU')
+
+    assert response.mimetype == 'text/csv'
+    assert response.is_streamed
+
+    streamed = pd.read_csv(io.BytesIO(response.data))
+    sales_mapping = registry.get_table('sales_mapping', 2019, 'US')
+
+    pd.testing.assert_frame_equal(
+        streamed,
+        sales_mapping[sales_mapping['AFFILIATE_COUNTRY_CODE'] == 'DEU'].reset_index(drop=True).astype(
+            {'AFFILIATE_COUNTRY_CODE': object, 'OTHER_COUNTRY_CODE': object, 'AFFILIATE_COUNTRY_NAME': object}
+        ),
+        check_exact=False
+    )
+
+
+def test_orients_and_precision(client):
+    sales_mapping = registry.get_table('sales_mapping', 2017, 'US')
+
+    split = json.loads(client.get('/US_sales_mapping?year=2017&orient=split').data)
+    assert split['columns'] == list(sales_mapping.columns)
+    assert len(split['data']) == len(sales_mapping)
+
+    arrays = json.loads(client.get('/US_sales_mapping?year=2017&orient=arrays&precision=2').data)
+    assert list(arrays) == list(sales_mapping.columns)
+    assert arrays['TOTAL_REVENUES'] == list(sales_mapping['TOTAL_REVENUES'].round(2))
+
+    records = json.loads(client.get('/US_sales_mapping?year=2017&orient=records&affiliate=FRA&limit=3').data)
+    assert len(records) == 3
+    assert set(records[0]) == set(sales_mapping.columns)
+
+    assert client.get('/US_sales_mapping?orient=index').status_code == 500
+    assert client.get('/US_sales_mapping?precision=16').status_code == 500
+
+
+def test_accept_encoding_negotiation(client):
+    identity = client.get('/US_sales_mapping?year=2016')
+
+    assert 'Content-Encoding' not in identity.headers
+    assert identity.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/US_sales_mapping?year=2016', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == identity.data
+
+    if 'br' in ENCODINGS:
+        response = client.get('/US_sales_mapping?year=2016', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.data) == identity.data
+
+    response = client.get('/US_sales_mapping?year=2016', headers={'Accept-Encoding': 'br;q=0.5, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+    # Variants serialized on demand are sent uncompressed
+    response = client.get('/US_sales_mapping?year=2016&precision=2', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compression_cache(tmp_path):
+    # With a cold on-disk cache, the payloads are compressed on their first request rather than at load time
+    cold_registry = TableRegistry(categorical=True)
+    cold_registry.compression_cache = CompressedPayloadCache(str(tmp_path))
+    cold_registry.load()
+
+    assert not cold_registry.compressed_payloads
+
+    key = ('sales_mapping', 2016, 'US', 'columns', 10)
+    compressed_payload = cold_registry.get_compressed_payload(*key, 'gzip')
+
+    assert gzip.decompress(compressed_payload) == cold_registry.payloads[key]
+    assert os.listdir(str(tmp_path)) == [os.path.basename(cold_registry.compression_cache.get_file_path(
+        cold_registry.payloads[key], 'gzip'
+    ))]
+
+    # Files of the payloads that are not served anymore are pruned
+    for encoding, extension in FILE_EXTENSIONS.items():
+        with open(os.path.join(str(tmp_path), f'{"0" * 64}.{extension}'), 'wb') as file:
+            file.write(b'')
+
+    assert cold_registry.compression_cache.prune([cold_registry.payloads[key]]) == len(FILE_EXTENSIONS)
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_conditional_requests(client):
+    response = client.get('/global_sales_mapping?year=2016&scope=unrestricted')
+    etag = response.headers['ETag']
+
+    assert not etag.startswith('W/')
+    assert response.headers['Last-Modified']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    not_modified = client.get('/global_sales_mapping?year=2016&scope=unrestricted', headers={'If-None-Match': etag})
+
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+    assert not_modified.headers['ETag'] == etag
+
+    # Tags weakened by a proxy or a CDN still match
+    weak = client.get('/global_sales_mapping?year=2016&scope=unrestricted', headers={'If-None-Match': 'W/' + etag})
+    assert weak.status_code == 304
+
+    # Other query arguments or content codings are different representations, with different tags
+    other = client.get(
+        '/global_sales_mapping?year=2016&scope=unrestricted&orient=split', headers={'If-None-Match': etag}
+    )
+    assert other.status_code == 200
+    assert other.headers['ETag'] != etag
+
+    compressed = client.get('/global_sales_mapping?year=2016&scope=unrestricted', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['ETag'] != etag
+
+    last_modified = client.get('/US_intermediary_dataframe_1?year=2017').headers['Last-Modified']
+
+    response = client.get('/US_intermediary_dataframe_1?year=2017', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    response = client.get(
+        '/US_intermediary_dataframe_1?year=2017', headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}
+    )
+    assert response.status_code == 200
+
+
+def test_batch(client):
+    items = [('sales_mapping', 2016, 'US'), ('sales_mapping', 2017, 'global_restricted')]
+
+    response = client.get('/batch?items=sales_mapping:2016:US,sales_mapping:2017:global_restricted&orient=split')
+    bundle = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert [(item['table'], item['year'], item['scope']) for item in bundle['items']] == items
+
+    for item, (table, year, scope) in zip(bundle['items'], items):
+        assert item['data'] == json.loads(registry.get_payload(table, year, scope, 'split'))
+
+    response = client.get(
+        '/batch?items=sales_mapping:2016:US&items=sales_mapping:2017:global_restricted&layout=stacked'
+    )
+    stacked = pd.DataFrame(json.loads(response.data))
+
+    expected = pd.concat(
+        [registry.get_table(*item).assign(YEAR=item[1], SCOPE=item[2]) for item in items], ignore_index=True
+    )
+
+    assert len(stacked) == len(expected)
+    assert list(stacked['YEAR'].unique()) == [2016, 2017]
+    assert stacked['PARENT_COUNTRY_CODE'].isnull().sum() == len(registry.get_table(*items[0]))
+    assert stacked['TOTAL_REVENUES'].sum() == pytest.approx(expected['TOTAL_REVENUES'].sum())
+    assert (stacked['OTHER_COUNTRY_CODE'] == expected['OTHER_COUNTRY_CODE']).all()
+
+    assert client.get('/batch?items=sales_mapping:2016:US&layout=stacked&precision=2').status_code == 200
+    assert client.get('/batch?items=sales_mapping:2016:US,irs:2016:US&layout=stacked').status_code == 500
+    assert client.get('/batch?items=sales_mapping:2019:global_restricted').status_code == 500
+    assert client.get('/batch').status_code == 500
+
+
+def test_aggregate(client):
+    sales_mapping = registry.get_table('sales_mapping', 2017, 'global_restricted')
+
+    response = client.get(
+        '/aggregate?scope=global_restricted&year=2017&group_by=OTHER_COUNTRY_CODE&metric=TOTAL_REVENUES&orient=records'
+    )
+    aggregate = pd.DataFrame(json.loads(response.data))
+    expected = sales_mapping.groupby('OTHER_COUNTRY_CODE', observed=True)['TOTAL_REVENUES'].sum()
+
+    # The groups of categorical columns are in order of appearance with pandas < 1.5, and sorted by the route
+    expected.index = expected.index.astype(str)
+    expected = expected.sort_index()
+
+    assert list(aggregate.columns) == ['OTHER_COUNTRY_CODE', 'TOTAL_REVENUES']
+    assert list(aggregate['OTHER_COUNTRY_CODE']) == list(expected.index)
+    assert aggregate['TOTAL_REVENUES'].to_numpy() == pytest.approx(expected.to_numpy())
+
+    # Group-bys that are not precomputed, on a filtered selection
+    response = client.get(
+        '/aggregate?scope=global_restricted&year=2017&group_by=OTHER_COUNTRY_CODE,AFFILIATE_COUNTRY_CODE'
+        + '&parent=FRA&orient=records'
+    )
+    aggregate = pd.DataFrame(json.loads(response.data))
+    expected = sales_mapping[sales_mapping['PARENT_COUNTRY_CODE'] == 'FRA'].groupby(
+        ['OTHER_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE'], observed=True
+    )[['UNRELATED_PARTY_REVENUES', 'RELATED_PARTY_REVENUES', 'TOTAL_REVENUES']].sum()
+
+    keys = ['OTHER_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE']
+    aggregate = aggregate.set_index(keys).sort_index()
+    expected.index = pd.MultiIndex.from_tuples([tuple(map(str, key)) for key in expected.index], names=keys)
+    expected = expected.sort_index()
+
+    assert list(aggregate.index) == list(expected.index)
+    assert aggregate['RELATED_PARTY_REVENUES'].to_numpy() == pytest.approx(
+        expected['RELATED_PARTY_REVENUES'].to_numpy()
+    )
+
+    response = client.get('/aggregate?scope=US&year=2016&group_by=CONTINENT_CODE&orient=records')
+    continents = {row['CONTINENT_CODE'] for row in json.loads(response.data)}
+
+    assert continents <= {'AFR', 'AMR', 'APAC', 'EUR', 'OTHER_GROUPS'}
+
+    assert client.get('/aggregate?scope=US&group_by=PARENT_COUNTRY_CODE').status_code == 500
+    assert client.get('/aggregate?scope=US&metric=REVENUES').status_code == 500
+
+
+def test_slice_and_matrix(client):
+    sales_mapping = registry.get_table('sales_mapping', 2016, 'global_unrestricted')
+
+    # The three country IDs are packed into one 32-bit key
+    assert registry.get_tensor('sales_mapping', 2016, 'global_unrestricted').keys.dtype == np.int32
+
+    response = client.get('/slice?scope=global_unrestricted&year=2016&parent=JPN&other=FRA,ITA&orient=records')
+    sliced = pd.DataFrame(json.loads(response.data))
+    expected = sales_mapping[
+        (sales_mapping['PARENT_COUNTRY_CODE'] == 'JPN') & sales_mapping['OTHER_COUNTRY_CODE'].isin(['FRA', 'ITA'])
+    ]
+
+    assert len(sliced) == len(expected) > 0
+    assert sliced['TOTAL_REVENUES'].sum() == pytest.approx(expected['TOTAL_REVENUES'].sum())
+
+    response = client.get(
+        '/matrix?scope=global_unrestricted&year=2016&rows=parent&columns=other&metric=RELATED_PARTY_REVENUES'
+    )
+    matrix = json.loads(response.data)
+    expected = sales_mapping.pivot_table(
+        index='PARENT_COUNTRY_CODE', columns='OTHER_COUNTRY_CODE', values='RELATED_PARTY_REVENUES', aggfunc='sum',
+        fill_value=0, observed=True
+    )
+
+    assert matrix['index'] == list(expected.index)
+    assert matrix['columns'] == list(expected.columns)
+    assert np.allclose(matrix['data'], expected.to_numpy())
+
+    # The parent of US multinationals is the United States
+    response = client.get('/matrix?scope=US&year=2019&rows=parent&columns=affiliate')
+    assert json.loads(response.data)['index'] == ['USA']
+
+    assert client.get('/matrix?scope=US&rows=other&columns=other').status_code == 500
+
+
+def test_timeseries(client):
+    response = client.get('/timeseries?scope=US&affiliate=FRA&metric=TOTAL_REVENUES&orient=records')
+    timeseries = pd.DataFrame(json.loads(response.data))
+
+    assert list(timeseries.columns) == [
+        'PARENT_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE', 'OTHER_COUNTRY_CODE', 'YEAR', 'TOTAL_REVENUES'
+    ]
+    # Every key has one row per year, with nulls for the years in which it is not observed
+    years = timeseries.groupby('OTHER_COUNTRY_CODE')['YEAR'].apply(list)
+    assert all(key_years == [2016, 2017, 2018, 2019] for key_years in years)
+
+    for year in [2016, 2017, 2018, 2019]:
+        sales_mapping = registry.get_table('sales_mapping', year, 'US')
+        expected = sales_mapping[sales_mapping['AFFILIATE_COUNTRY_CODE'] == 'FRA']
+
+        observed = timeseries[(timeseries['YEAR'] == year) & timeseries['TOTAL_REVENUES'].notnull()]
+
+        assert len(observed) == len(expected)
+        assert observed['TOTAL_REVENUES'].sum() == pytest.approx(expected['TOTAL_REVENUES'].sum())
+
+    etag = response.headers['ETag']
+    assert client.get(
+        '/timeseries?scope=US&affiliate=FRA&metric=TOTAL_REVENUES&orient=records', headers={'If-None-Match': etag}
+    ).status_code == 304
+
+    assert client.get('/timeseries?scope=EU').status_code == 500
+
+
+def test_diff(client):
+    left = registry.get_table('oecd', 2016, 'global_restricted')
+    right = registry.get_table('oecd', 2016, 'global_unrestricted')
+
+    response = client.get('/diff?left=oecd:2016:global_restricted&right=oecd:2016:global_unrestricted&orient=records')
+    diff = pd.DataFrame(json.loads(response.data))
+
+    expected = left.merge(right, on=['PARENT_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE'], how='outer', indicator=True)
+
+    assert len(diff) == len(expected)
+    assert (diff['STATUS'] == 'added').sum() == (expected['_merge'] == 'right_only').sum()
+    assert (diff['STATUS'] == 'removed').sum() == (expected['_merge'] == 'left_only').sum()
+
+    common = expected[expected['_merge'] == 'both']
+    assert diff['TOTAL_REVENUES_CHANGE'].sum() == pytest.approx(
+        (common['TOTAL_REVENUES_y'] - common['TOTAL_REVENUES_x']).sum()
+    )
+
+    # Year-over-year comparison of the US sales mappings, restricted to the keys that appeared
+    response = client.get('/diff?left=sales_mapping:2016:US&right=sales_mapping:2017:US&status=added&orient=records')
+    added = pd.DataFrame(json.loads(response.data))
+
+    keys = ['AFFILIATE_COUNTRY_CODE', 'OTHER_COUNTRY_CODE']
+    previous_keys = set(map(tuple, registry.get_table('sales_mapping', 2016, 'US')[keys].to_numpy()))
+
+    assert set(added['STATUS']) == {'added'}
+    assert set(added['PARENT_COUNTRY_CODE']) == {'USA'}
+    assert not previous_keys & set(map(tuple, added[keys].to_numpy()))
+    assert added['TOTAL_REVENUES_LEFT'].isnull().all()
+
+    # Payloads of the comparisons between output files are cached
+    assert (('sales_mapping', 2016, 'US'), ('sales_mapping', 2017, 'US')) in registry.diff_pairs
+    client.get('/diff?left=sales_mapping:2016:US&right=sales_mapping:2017:US')
+    assert (('sales_mapping', 2016, 'US'), ('sales_mapping', 2017, 'US'), 'columns', 10) in registry.diff_payloads
+
+    assert client.get('/diff?left=oecd:2016:global_restricted&right=irs:2016:US').status_code == 500
+    assert client.get('/diff?left=oecd:2016:global_restricted').status_code == 500
+
+
+def test_ranking(client):
+    sales_mapping = registry.get_table('sales_mapping', 2017, 'global_restricted')
+
+    response = client.get(
+        '/global_sales_mapping?year=2017&parent=FRA&sort_by=TOTAL_REVENUES&top=20'
+        + '&orient=records'
+    )
+    top = pd.DataFrame(json.loads(response.data))
+    expected = sales_mapping[sales_mapping['PARENT_COUNTRY_CODE'] == 'FRA'].nlargest(20, 'TOTAL_REVENUES')
+
+    assert list(top['TOTAL_REVENUES']) == list(expected['TOTAL_REVENUES'])
+    assert response.headers['X-Total-Count'] == '20'
+
+    # Several parents and other filters
+    response = client.get(
+        '/global_sales_mapping?year=2017&parent=FRA,DEU&other=USA'
+        + '&sort_by=RELATED_PARTY_REVENUES&order=asc&top=5&orient=records'
+    )
+    top = pd.DataFrame(json.loads(response.data))
+    expected = sales_mapping[
+        sales_mapping['PARENT_COUNTRY_CODE'].isin(['FRA', 'DEU']) & (sales_mapping['OTHER_COUNTRY_CODE'] == 'USA')
+    ].nsmallest(5, 'RELATED_PARTY_REVENUES')
+
+    assert list(top['RELATED_PARTY_REVENUES']) == list(expected['RELATED_PARTY_REVENUES'])
+
+    intermediary_df = registry.get_table('intermediary_dataframe_1', 2018, 'US')
+
+    response = client.get('/US_intermediary_dataframe_1?year=2018&sort_by=RELATED_PARTY_REVENUES&top=10&orient=records')
+    top = pd.DataFrame(json.loads(response.data))
+
+    assert list(top['CODE']) == list(intermediary_df.nlargest(10, 'RELATED_PARTY_REVENUES')['CODE'])
+
+    # Sorted tables without top are paginated as the others
+    response = client.get('/US_sales_mapping?year=2016&sort_by=TOTAL_REVENUES&order=asc&limit=100&orient=records')
+    assert response.headers['X-Total-Count'] == str(len(registry.get_table('sales_mapping', 2016, 'US')))
+    assert pd.DataFrame(json.loads(response.data))['TOTAL_REVENUES'].is_monotonic_increasing
+
+    assert client.get('/US_sales_mapping?year=2016&sort_by=OTHER_COUNTRY_CODE').status_code == 500
+    assert client.get('/US_sales_mapping?year=2016&top=10').status_code == 500
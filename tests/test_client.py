@@ -0,0 +1,115 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from werkzeug.serving import make_server
+
+from dbs_api.app import app
+from dbs_api.client import Client, get_size
+from dbs_api.registry import get_file_name, path_to_outputs
+
+
+@pytest.fixture(scope='module')
+def url():
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{server.server_port}'
+
+    server.shutdown()
+
+
+def read_output(*key):
+    return pd.read_csv(os.path.join(path_to_outputs, get_file_name(*key)))
+
+
+def test_cached_tables_are_revalidated(url, tmp_path):
+    with Client(url, cache_dir=str(tmp_path)) as client:
+        df = client.get_table('sales_mapping', 2017, 'global_unrestricted')
+
+        pd.testing.assert_frame_equal(df, read_output('sales_mapping', 2017, 'global_unrestricted'))
+        assert client.stats == {'downloaded': 1, 'revalidated': 0, 'uncached': 0}
+
+        # Tables are cached as data files only, which are read without unpickling anything
+        file_names = sorted(os.listdir(str(tmp_path)))
+
+        assert [os.path.splitext(file_name)[1] for file_name in file_names] == ['.columnar', '.etag']
+        assert all(
+            file_name.endswith('.npy') or file_name == 'schema.json'
+            for file_name in os.listdir(os.path.join(str(tmp_path), file_names[0]))
+        )
+
+        # The same request is answered with a 304 and decoded from the disk cache, also by a new client
+        pd.testing.assert_frame_equal(client.get_table('sales_mapping', 2017, 'global_unrestricted'), df)
+        assert client.stats['revalidated'] == 1
+
+    with Client(url, cache_dir=str(tmp_path)) as client:
+        pd.testing.assert_frame_equal(client.get_table('sales_mapping', 2017, 'global_unrestricted'), df)
+        assert client.stats == {'downloaded': 0, 'revalidated': 1, 'uncached': 0}
+
+        # Other arguments are cached separately
+        filtered = client.get_table('sales_mapping', 2017, 'global_unrestricted', parent=['FRA', 'DEU'])
+
+        assert set(filtered['PARENT_COUNTRY_CODE']) == {'FRA', 'DEU'}
+        assert client.stats['downloaded'] == 1
+
+
+def test_concurrent_tables(url, tmp_path):
+    keys = [
+        ('sales_mapping', 2016, 'US'),
+        ('sales_mapping', 2016, 'global_restricted'),
+        ('intermediary_dataframe_2', 2017, 'global_restricted'),
+        ('intermediary_dataframe_1', 2016, 'global_unrestricted'),
+        ('irs', 2019, 'US'),
+        ('oecd', 2017, 'global_unrestricted'),
+    ]
+
+    with Client(url, cache_dir=str(tmp_path)) as client:
+        tables = client.get_tables(keys)
+
+        # Each thread has its own session, all of them sharing the connections
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.get_session()))
+        thread.start()
+        thread.join()
+
+        assert sessions[0] is not client.get_session()
+        assert sessions[0].get_adapter(url) is client.get_session().get_adapter(url)
+
+    assert list(tables) == keys
+
+    for key, df in tables.items():
+        pd.testing.assert_frame_equal(df, read_output(*key), check_dtype=False)
+
+
+def test_cache_is_bounded(url, tmp_path):
+    keys = [('sales_mapping', 2016, 'US'), ('sales_mapping', 2017, 'US')]
+
+    with Client(url, cache_dir=str(tmp_path)) as client:
+        client.get_tables(keys[:1])
+        file_names = set(os.listdir(str(tmp_path)))
+
+        client.get_tables(keys[1:])
+        cache_size = sum(get_size(os.path.join(str(tmp_path), file_name)) for file_name in os.listdir(str(tmp_path)))
+
+        client.clear_cache()
+        assert not os.path.exists(str(tmp_path))
+
+    # The least recently used table is deleted once the cache is full
+    with Client(url, cache_dir=str(tmp_path), max_cache_size=cache_size - 1) as client:
+        client.get_tables(keys[:1])
+        client.get_tables(keys[1:])
+
+        assert not file_names & set(os.listdir(str(tmp_path)))
+        assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_frames_without_cache(url):
+    with Client(url, cache_dir=None) as client:
+        df = client.get_frame('/aggregate', scope='US', year=2016, group_by='CONTINENT_CODE')
+
+        assert 'CONTINENT_CODE' in df.columns
+        assert client.stats == {'downloaded': 0, 'revalidated': 0, 'uncached': 1}
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dbs_api.columnar import read_columnar, write_columnar, get_columnar_dir, read_schema
+from dbs_api.registry import iter_table_keys, get_file_name, path_to_outputs
+
+
+def test_columnar_copies_hold_the_same_data_as_the_csv_files():
+    for key in iter_table_keys():
+        file_name = get_file_name(*key)
+
+        csv = pd.read_csv(os.path.join(path_to_outputs, file_name), float_precision='round_trip')
+        columnar = read_columnar(get_columnar_dir(file_name))
+
+        pd.testing.assert_frame_equal(csv, columnar)
+
+
+def test_columnar_round_trip(tmp_path):
+    df = pd.DataFrame(
+        {
+            'PARENT_COUNTRY_CODE': ['FRA', 'FRA', 'USA'],
+            'PARENT_COUNTRY_NAME': ['France', np.nan, 'United States'],
+            'NB_AFFILIATE_COUNTRIES': [3, 4, 5],
+            'TOTAL_REVENUES': [1.5, np.nan, 68821625.36771819],
+        }
+    )
+
+    path_to_table = os.path.join(tmp_path, 'table')
+    write_columnar(df, path_to_table)
+
+    assert read_schema(path_to_table)['n_rows'] == 3
+
+    loaded = read_columnar(path_to_table)
+
+    pd.testing.assert_frame_equal(df, loaded)
+    assert not loaded['TOTAL_REVENUES'].to_numpy().flags.writeable
+
+    # Missing strings are read back as missing values, also in the categorical mode
+    categorical = read_columnar(path_to_table, categorical=True)
+
+    assert list(categorical['PARENT_COUNTRY_NAME'].cat.categories) == ['France', 'United States']
+    assert categorical['PARENT_COUNTRY_NAME'].isnull().tolist() == [False, True, False]
+    assert df.to_json() == loaded.to_json() == categorical.to_json()
+
+
+def test_categorical_columns_serialize_as_strings():
+    for key in iter_table_keys():
+        path_to_table = get_columnar_dir(get_file_name(*key))
+
+        strings = read_columnar(path_to_table)
+        categorical = read_columnar(path_to_table, categorical=True)
+
+        assert not (categorical.dtypes == object).any()
+
+        for orient in ['columns', 'split', 'records']:
+            assert strings.to_json(orient=orient) == categorical.to_json(orient=orient)
+
+        assert strings.to_csv(index=False) == categorical.to_csv(index=False)
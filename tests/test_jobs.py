@@ -0,0 +1,153 @@
+import os
+import time
+
+import pytest
+
+from dbs_api.app import app, computation_pool
+from dbs_api.jobs import ComputationPool, normalize_parameters, get_job_id
+
+
+def compute_fake_sales_mapping(scope, parameters):
+    time.sleep(0.5)
+
+    if parameters['US_winsorizing_threshold'] == 1:
+        raise ValueError('The computation failed.')
+
+    return f'{{"scope": "{scope}", "year": {parameters["year"]}}}'.encode('utf-8')
+
+
+def compute_and_crash(scope, parameters):
+    os._exit(1)
+
+
+def wait_for(pool, job_id):
+    for _ in range(100):
+        if pool.get_status(job_id) != 'pending':
+            break
+
+        time.sleep(0.1)
+
+    return pool.get_status(job_id)
+
+
+def test_normalize_parameters():
+    _, parameters = normalize_parameters('global_restricted', 2016, {'breakdown_threshold': '40', 'other': 'x'})
+
+    assert parameters['breakdown_threshold'] == 40
+    assert parameters['load_data_online'] is False
+    assert 'other' not in parameters
+
+    _, default = normalize_parameters('US', 2018, {})
+    _, explicit = normalize_parameters('US', 2018, {'macro_indicator': 'CONS', 'US_winsorizing_threshold': '0.5'})
+
+    assert get_job_id('US', default) == get_job_id('US', explicit)
+
+    with pytest.raises(Exception):
+        normalize_parameters('US', 2018, {'breakdown_threshold': '40'})
+
+    with pytest.raises(Exception):
+        normalize_parameters('global_restricted', 2019, {})
+
+    with pytest.raises(Exception):
+        normalize_parameters('US', 2018, {'US_winsorizing_threshold': 'high'})
+
+
+def test_computation_pool(tmp_path):
+    pool = ComputationPool(compute=compute_fake_sales_mapping, max_cached_results=1, path=str(tmp_path))
+
+    _, parameters = normalize_parameters('US', 2017, {})
+    _, other_parameters = normalize_parameters('US', 2016, {})
+
+    # Identical concurrent requests are merged into a single job
+    job_id = pool.submit('US', parameters)
+    assert pool.submit('US', parameters) == job_id
+    assert len(pool.pending) == 1
+    assert pool.get_status(job_id) == 'pending'
+
+    assert wait_for(pool, job_id) == 'done'
+    assert pool.get_result(job_id) == b'{"scope": "US", "year": 2017}'
+
+    # The memory cache only holds one result, the other one is read back from the disk
+    other_job_id = pool.submit('US', other_parameters)
+    assert wait_for(pool, other_job_id) == 'done'
+    assert list(pool.results) == [other_job_id]
+
+    assert ComputationPool(path=str(tmp_path)).get_result(job_id) == b'{"scope": "US", "year": 2017}'
+
+    _, failing_parameters = normalize_parameters('US', 2017, {'US_winsorizing_threshold': '1'})
+    failing_job_id = pool.submit('US', failing_parameters)
+
+    assert wait_for(pool, failing_job_id) == 'failed'
+    assert 'The computation failed.' in pool.get_error(failing_job_id)
+
+
+def test_computation_pool_across_workers(tmp_path):
+    # Two pools sharing a directory, as the gunicorn workers do
+    pool = ComputationPool(compute=compute_fake_sales_mapping, path=str(tmp_path))
+    other_pool = ComputationPool(compute=compute_fake_sales_mapping, path=str(tmp_path))
+
+    _, parameters = normalize_parameters('US', 2017, {})
+
+    job_id = pool.submit('US', parameters)
+    assert other_pool.get_status(job_id) == 'pending'
+    assert other_pool.submit('US', parameters) == job_id
+    assert not other_pool.pending
+
+    assert wait_for(other_pool, job_id) == 'done'
+    assert not os.path.exists(os.path.join(tmp_path, f'{job_id}.pending'))
+
+    # Failures are reported by every worker
+    _, failing_parameters = normalize_parameters('US', 2017, {'US_winsorizing_threshold': '1'})
+    failing_job_id = pool.submit('US', failing_parameters)
+
+    assert wait_for(other_pool, failing_job_id) == 'failed'
+    assert 'The computation failed.' in other_pool.get_error(failing_job_id)
+
+    # The marker of a worker that died is ignored
+    _, other_parameters = normalize_parameters('US', 2016, {})
+    other_job_id = get_job_id('US', other_parameters)
+
+    with open(os.path.join(tmp_path, f'{other_job_id}.pending'), 'w') as file:
+        file.write(str(2 ** 22 + 1))
+
+    assert other_pool.get_status(other_job_id) == 'unknown'
+    assert other_pool.submit('US', other_parameters) == other_job_id
+    assert wait_for(other_pool, other_job_id) == 'done'
+
+
+def test_computation_pool_recovers(tmp_path):
+    pool = ComputationPool(compute=compute_and_crash, path=str(tmp_path))
+
+    _, parameters = normalize_parameters('US', 2017, {})
+    _, other_parameters = normalize_parameters('US', 2016, {})
+
+    # A process of the pool that dies breaks the pool, which is replaced for the next jobs
+    job_id = pool.submit('US', parameters)
+    assert wait_for(pool, job_id) == 'failed'
+
+    pool.compute = compute_fake_sales_mapping
+    other_job_id = pool.submit('US', other_parameters)
+    assert wait_for(pool, other_job_id) == 'done'
+
+
+def test_custom_sales_mapping_routes(tmp_path, monkeypatch):
+    monkeypatch.setattr(computation_pool, 'compute', compute_fake_sales_mapping)
+    monkeypatch.setattr(computation_pool, 'path', str(tmp_path))
+
+    client = app.test_client()
+
+    response = client.get('/custom_sales_mapping?scope=global_unrestricted&year=2016&breakdown_threshold=30')
+    job_url = response.json['url']
+
+    assert response.status_code == 202
+    assert response.headers['Location'] == job_url
+    assert client.get(job_url).status_code == 202
+
+    wait_for(computation_pool, response.json['job_id'])
+
+    assert client.get(job_url).json == {'scope': 'global_unrestricted', 'year': 2016}
+
+    response = client.get('/custom_sales_mapping?scope=global_unrestricted&year=2016&breakdown_threshold=30')
+    assert response.json['status'] == 'done'
+
+    assert client.get('/custom_sales_mapping/unknown').status_code == 404
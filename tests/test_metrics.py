@@ -0,0 +1,102 @@
+import os
+import json
+import time
+
+from dbs_api.app import app
+from dbs_api.metrics import MetricsRegistry
+from dbs_api.profiling import SamplingProfiler
+
+
+def test_prometheus_text_format(tmp_path):
+    metrics = MetricsRegistry(str(tmp_path))
+
+    counter = metrics.counter('lookups_total', 'Lookups', ['cache', 'result'])
+    histogram = metrics.histogram('duration_seconds', 'Durations', ['route'], buckets=[0.1, 1])
+
+    counter.inc('payloads', 'hit')
+    counter.inc('payloads', 'hit')
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+
+    # Snapshot saved by another live process, here the parent of the test process
+    with open(os.path.join(str(tmp_path), f'{os.getppid()}.json'), 'w') as file:
+        json.dump({'lookups_total': {json.dumps(['payloads', 'hit']): 3}}, file)
+
+    # Files that are not snapshots of a worker are ignored
+    with open(os.path.join(str(tmp_path), 'notes.json'), 'w') as file:
+        file.write('{}')
+
+    lines = metrics.render().splitlines()
+
+    assert '# TYPE lookups_total counter' in lines
+    assert 'lookups_total{cache="payloads",result="hit"} 5' in lines
+    assert '# TYPE duration_seconds histogram' in lines
+    assert 'duration_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'duration_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'duration_seconds_count{route="/a"} 3' in lines
+
+
+def test_metrics_route():
+    client = app.test_client()
+
+    # The metrics of a request are recorded once the server closes the response
+    for url in ['/US_sales_mapping?year=2016', '/US_sales_mapping?year=2016&affiliate=FRA&format=csv']:
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        response.data
+        response.close()
+
+    response = client.get('/metrics')
+    lines = response.data.decode('utf-8').splitlines()
+
+    assert response.mimetype == 'text/plain'
+
+    for phase in ['load', 'filter', 'serialize', 'compress', 'send']:
+        prefix = f'dbs_api_request_phase_duration_seconds_count{{route="/US_sales_mapping",phase="{phase}"}}'
+        assert any(line.startswith(prefix) for line in lines)
+
+    assert any(line.startswith('dbs_api_response_size_bytes_sum{route="/US_sales_mapping"}') for line in lines)
+    assert any(
+        line.startswith('dbs_api_cache_lookups_total{cache="compressed_payloads",result="hit"}') for line in lines
+    )
+
+
+def busy_loop(duration):
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < duration:
+        pass
+
+
+def test_slow_request_profiles(tmp_path):
+    profiler = SamplingProfiler(threshold=0.05, interval=0.001, path=str(tmp_path))
+
+    profiler.begin()
+    busy_loop(0.01)
+    assert profiler.end(0.01, 'fast') is None
+
+    profiler.begin()
+    busy_loop(0.1)
+    file_path = profiler.end(0.1, 'slow')
+
+    with open(file_path) as file:
+        lines = file.read().splitlines()
+
+    assert lines[0].startswith('# slow')
+    assert any('busy_loop (test_metrics.py' in line for line in lines[1:])
+
+
+def test_profiles_are_pruned(tmp_path):
+    profiler = SamplingProfiler(threshold=0.05, interval=0.001, path=str(tmp_path), max_profiles=2)
+
+    file_paths = []
+
+    for index in range(4):
+        profiler.begin()
+        busy_loop(0.06)
+        file_paths.append(profiler.end(0.06, f'slow_{index}'))
+
+        os.utime(file_paths[-1], (index, index))
+
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(file_path) for file_path in file_paths[2:])
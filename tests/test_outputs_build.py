@@ -0,0 +1,53 @@
+import os
+
+from dbs_api.outputs import (
+    COMBINATIONS, get_file_names, get_output_paths, get_parameters_hash, is_up_to_date, read_manifest, write_manifest,
+    path_to_outputs
+)
+from dbs_api.registry import iter_table_keys, get_file_name
+
+
+def test_combinations_cover_every_output_file():
+    file_names = [file_name for scope, year in COMBINATIONS for file_name in get_file_names(scope, year)]
+
+    assert sorted(file_names) == sorted(get_file_name(*key) for key in iter_table_keys())
+
+
+def test_parameters_hash():
+    assert get_parameters_hash('global_restricted', 2016) == get_parameters_hash('global_restricted', 2016)
+    assert get_parameters_hash('global_restricted', 2016) != get_parameters_hash('global_unrestricted', 2016)
+    assert get_parameters_hash('US', 2016) != get_parameters_hash('US', 2017)
+
+
+def test_manifest_and_incremental_build(tmp_path):
+    path = str(tmp_path)
+
+    assert read_manifest(path) == {'combinations': {}}
+
+    manifest = {
+        'combinations': {
+            'US_2016': {
+                'parameters_hash': get_parameters_hash('US', 2016),
+                'package_version': '0.1',
+                'files': get_output_paths('US', 2016),
+            }
+        }
+    }
+    write_manifest(manifest, path)
+
+    assert read_manifest(path) == manifest
+    assert not os.path.exists(os.path.join(path, 'manifest.json.tmp'))
+
+    assert is_up_to_date(manifest, 'US', 2016, '0.1', path_to_outputs)
+    assert not is_up_to_date(manifest, 'US', 2016, '0.2', path_to_outputs)
+    assert not is_up_to_date(manifest, 'US', 2017, '0.1', path_to_outputs)
+
+    # Missing output files force the combination to be recomputed, the columnar copies included
+    assert not is_up_to_date(manifest, 'US', 2016, '0.1', path)
+
+    for file_name in get_file_names('US', 2016):
+        with open(os.path.join(path, file_name), 'w') as file:
+            file.write('')
+
+    assert not is_up_to_date(manifest, 'US', 2016, '0.1', path)
+    assert os.path.join('columnar', 'sales_mapping_US_2016') in get_output_paths('US', 2016)
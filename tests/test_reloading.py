@@ -0,0 +1,73 @@
+import threading
+
+from dbs_api.outputs import publish_version, write_manifest
+from dbs_api.reloading import RegistryReloader
+
+
+class FakeRegistry:
+
+    def __init__(self, data_version):
+        self.data_version = data_version
+
+
+def test_reload_on_new_version(tmp_path):
+    path = str(tmp_path)
+    manifest = {'combinations': {}}
+
+    versions = iter(['v1', 'v2'])
+    release = threading.Event()
+
+    def load_registry():
+        registry = FakeRegistry(next(versions))
+
+        if registry.data_version == 'v2':
+            release.wait(5)
+
+        return registry
+
+    reloader = RegistryReloader(load_registry, path, check_interval=0)
+    registry = reloader.get()
+
+    assert registry.data_version == 'v1'
+    assert not reloader.check()
+
+    # Rewriting the manifest during a build does not trigger any reload
+    write_manifest({'combinations': {}, 'version': 'v1'}, path)
+    assert not reloader.check()
+
+    manifest['version'] = 'v1'
+    publish_version(manifest, path)
+    assert reloader.check()
+
+    # The current registry serves the requests until the new one is loaded
+    assert reloader.get() is registry
+
+    release.set()
+    reloader.thread.join()
+
+    assert reloader.get().data_version == 'v2'
+    assert registry.data_version == 'v1'
+
+
+def test_failed_reload_keeps_current_registry(tmp_path):
+    path = str(tmp_path)
+    calls = []
+
+    def load_registry():
+        calls.append(None)
+
+        if len(calls) > 1:
+            raise OSError('Incomplete outputs')
+
+        return FakeRegistry(None)
+
+    reloader = RegistryReloader(load_registry, path, check_interval=0)
+    registry = reloader.get()
+
+    publish_version({'combinations': {}}, path)
+
+    assert reloader.check()
+    reloader.thread.join()
+
+    assert reloader.get() is registry
+    assert len(calls) == 2
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from dbs_api.columnar import read_columnar, get_columnar_dir
+from dbs_api.registry import iter_table_keys, get_file_name
+from dbs_api.schemas import validate_table, apply_schema
+from dbs_api.serialization import to_json
+from dbs_api.tensor import CountryDictionary
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return {key: read_columnar(get_columnar_dir(get_file_name(*key))) for key in iter_table_keys()}
+
+
+def test_compact_dtypes(tables):
+    countries = CountryDictionary.from_tables(tables.values())
+    memory = {'object': 0, 'compact': 0}
+
+    for (table, year, scope), df in tables.items():
+        validate_table(df, table, year)
+
+        compact = apply_schema(df, table, year, countries)
+
+        assert not (compact.dtypes == object).any()
+
+        memory['object'] += df.memory_usage(deep=True).sum()
+        memory['compact'] += compact.memory_usage(deep=True).sum()
+
+        # Country columns share the categories of the dictionary, whose codes are the IDs of the countries
+        for column in ['PARENT_COUNTRY_CODE', 'AFFILIATE_COUNTRY_CODE', 'COUNTRY_CODE']:
+            if column in compact.columns:
+                assert compact[column].dtype == countries.dtype
+                assert list(countries.encode(compact[column])) == list(countries.encode(df[column]))
+
+        for orient in ['columns', 'split', 'arrays']:
+            assert to_json(compact, orient) == to_json(df, orient)
+
+    # Even with the shared categories counted in each column
+    assert memory['compact'] * 4 < memory['object']
+
+
+def test_validation(tables):
+    df = tables[('oecd', 2016, 'global_restricted')]
+
+    with pytest.raises(ValueError, match='Unknown columns'):
+        validate_table(df.assign(EXTRA=1), 'oecd', 2016)
+
+    with pytest.raises(ValueError, match="missing columns: \\['CONTINENT_CODE'\\]"):
+        validate_table(df.drop(columns='CONTINENT_CODE'), 'oecd', 2016)
+
+    with pytest.raises(ValueError, match="wrong type: \\['TOTAL_REVENUES'\\]"):
+        validate_table(df.assign(TOTAL_REVENUES='0'), 'oecd', 2016)
+
+    # The columns named after the year of the table
+    with pytest.raises(ValueError):
+        validate_table(tables[('intermediary_dataframe_2', 2016, 'US')], 'intermediary_dataframe_2', 2017)
+
+    countries = CountryDictionary(['FRA', 'USA'])
+
+    with pytest.raises(ValueError, match='unknown country codes'):
+        apply_schema(df, 'oecd', 2016, countries)
+
+
+def test_diagnostics():
+    from dbs_api.app import app
+
+    diagnostics = app.test_client().get('/diagnostics').get_json()
+
+    assert len(diagnostics['tables']) == 32
+    assert diagnostics['memory'] == sum(table['memory'] for table in diagnostics['tables'])
+    assert all(table['dtypes']['AFFILIATE_COUNTRY_CODE'] == 'category' for table in diagnostics['tables'] if (
+        table['table'] == 'sales_mapping'
+    ))